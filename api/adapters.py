@@ -0,0 +1,177 @@
+# api/adapters.py
+"""Several PEFT LoRA adapters served on top of one copy of the base weights.
+
+The base model is wrapped in a PeftModel once; adapters are loaded from
+``ADAPTERS_DIR`` on first use and the active one is switched per batch with
+``set_adapter`` instead of being merged into the weights. Loaded adapters are
+kept in an LRU bounded by count and bytes.
+"""
+import collections
+import contextlib
+import os
+import threading
+
+import metrics
+
+# Request model name that runs the plain base weights with every adapter disabled
+BASE_MODEL_NAME = "base"
+
+
+class UnknownAdapterError(Exception):
+    """Raised when a request names an adapter that doesn't exist."""
+
+
+def adapter_nbytes(model, name):
+    """Bytes held by the LoRA weights of one loaded adapter."""
+    return sum(
+        param.numel() * param.element_size()
+        for param_name, param in model.named_parameters()
+        if f".{name}." in param_name and "lora_" in param_name
+    )
+
+
+def find_adapters(adapters_dir):
+    """Map adapter name (its directory name) to path for every PEFT adapter in a directory."""
+    found = {}
+    if not adapters_dir or not os.path.isdir(adapters_dir):
+        return found
+    for entry in sorted(os.listdir(adapters_dir)):
+        path = os.path.join(adapters_dir, entry)
+        if os.path.isfile(os.path.join(path, "adapter_config.json")):
+            found[entry] = path
+    return found
+
+
+class AdapterRegistry:
+    """Loads adapters on demand and activates one per generation.
+
+    The default adapter is loaded at startup and never evicted. Others are
+    loaded the first time a request names them and evicted least recently
+    used first once more than ``max_loaded`` are resident or their LoRA
+    weights exceed ``max_bytes``. Activating an adapter changes the shared
+    model, so generations run one at a time while adapters are in use.
+    """
+
+    def __init__(self, model, adapters_dir, default_name, max_loaded=4, max_bytes=256 * 1024 * 1024,
+                 prefix_cache_factory=None):
+        self.model = model
+        self.adapters_dir = adapters_dir
+        self.default_name = default_name
+        self.max_loaded = max_loaded
+        self.max_bytes = max_bytes
+        self.prefix_cache_factory = prefix_cache_factory
+        self._loaded = collections.OrderedDict()
+        self._paths = find_adapters(adapters_dir)
+        self._prefix_caches = {}
+        # Held for a whole generation; _lock only guards the bookkeeping, so
+        # stats stay readable while a worker is generating
+        self._generation_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+        # Without its adapter, the default name serves the base weights
+        self._default = BASE_MODEL_NAME
+        if default_name in getattr(model, "peft_config", {}):
+            self._default = default_name
+        for name in getattr(model, "peft_config", {}):
+            self._loaded[name] = adapter_nbytes(model, name)
+
+    def resolve(self, name):
+        """Canonical adapter name for a request's ``model`` field."""
+        if not name or name == self.default_name:
+            return self._default
+        if name == BASE_MODEL_NAME or name in self._loaded:
+            return name
+        if name not in self._paths:
+            # Pick up adapters copied into the directory after startup
+            self._paths = find_adapters(self.adapters_dir)
+        if name not in self._paths:
+            raise UnknownAdapterError(f"Unknown model {name!r}")
+        return name
+
+    def names(self):
+        return sorted({self.default_name, BASE_MODEL_NAME, *self._paths, *self._loaded})
+
+    def prefix_cache(self, name):
+        """Prefix KV caches depend on the adapter's weights, so each adapter gets its own."""
+        if self.prefix_cache_factory is None:
+            return None
+        with self._lock:
+            cache = self._prefix_caches.get(name)
+            if cache is None:
+                cache = self._prefix_caches[name] = self.prefix_cache_factory()
+            return cache
+
+    @contextlib.contextmanager
+    def activate(self, name):
+        """Run the enclosed generation with adapter ``name`` active (worker thread)."""
+        with self._generation_lock:
+            if name == BASE_MODEL_NAME:
+                with self.model.disable_adapter():
+                    yield self.model
+                return
+            self._ensure_loaded(name)
+            self.model.set_adapter(name)
+            yield self.model
+
+    def bind(self, name, fn):
+        """Wrap ``fn(engine, tokenizer, *args)`` so it runs with adapter ``name`` active."""
+        def run(engine, tokenizer, *args):
+            with self.activate(name):
+                return fn(engine, tokenizer, *args)
+        return run
+
+    def batch_fn(self, fn):
+        """Wrap a batch function whose items are ``(adapter, item)`` pairs.
+
+        Callers batch by adapter, so every item of a batch names the same one.
+        """
+        def run(engine, tokenizer, items, controls):
+            name = items[0][0]
+            with self.activate(name):
+                return fn(engine, tokenizer, [item for _, item in items], controls,
+                          prefix_cache=self.prefix_cache(name))
+        return run
+
+    def stats(self):
+        with self._lock:
+            return {
+                "default": self.default_name,
+                "available": self.names(),
+                "loaded": {name: nbytes for name, nbytes in self._loaded.items()},
+                "bytes": sum(self._loaded.values()),
+                "max_bytes": self.max_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "prefix_caches": {name: cache.stats() for name, cache in self._prefix_caches.items()},
+            }
+
+    def _ensure_loaded(self, name):
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                metrics.ADAPTER_EVENTS.labels("hit").inc()
+                return
+        print(f"Loading adapter {name} from {self._paths[name]}...")
+        self.model.load_adapter(self._paths[name], adapter_name=name)
+        nbytes = adapter_nbytes(self.model, name)
+        metrics.ADAPTER_EVENTS.labels("load").inc()
+        with self._lock:
+            self._loaded[name] = nbytes
+            self.loads += 1
+        self._evict(keep=name)
+
+    def _evict(self, keep):
+        while True:
+            with self._lock:
+                if len(self._loaded) <= self.max_loaded and sum(self._loaded.values()) <= self.max_bytes:
+                    return
+                victim = next((n for n in self._loaded if n not in (keep, self._default)), None)
+                if victim is None:
+                    return
+                del self._loaded[victim]
+                self._prefix_caches.pop(victim, None)
+                self.evictions += 1
+            print(f"Evicting adapter {victim}")
+            self.model.delete_adapter(victim)
+            metrics.ADAPTER_EVENTS.labels("evicted").inc()
@@ -0,0 +1,115 @@
+# api/context_window.py
+"""Fit chat histories into the model's context window by dropping the oldest turns."""
+import collections
+from dataclasses import dataclass
+from typing import List
+
+import metrics
+
+
+class PromptTooLongError(Exception):
+    """Raised when the system prompt and latest turn alone exceed the prompt budget."""
+
+
+@dataclass
+class FittedHistory:
+    """A history trimmed to the budget, with what it cost to get there."""
+
+    messages: List[dict]
+    prompt_tokens: int
+    dropped_tokens: int
+    dropped_messages: int
+
+    def report(self):
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "dropped_tokens": self.dropped_tokens,
+            "dropped_messages": self.dropped_messages,
+        }
+
+
+class ContextWindow:
+    """Counts chat-template tokens per message and trims histories to a prompt budget.
+
+    Token counts are cached per ``(role, content)``, so a history that is sent
+    again with one more turn only tokenizes the new message. The leading
+    system messages and the latest message are always kept; the oldest of the
+    turns in between are dropped until the prompt fits. The summed counts only
+    estimate the joined prompt, so the kept history is rendered once to check
+    it, dropping another turn if it is still too long. Lives on the event
+    loop, so no locking.
+    """
+
+    def __init__(self, tokenizer, context_tokens=2048, prompt_budget=0, max_entries=4096):
+        self.tokenizer = tokenizer
+        self.context_tokens = context_tokens
+        self.prompt_budget = prompt_budget
+        self.max_entries = max_entries
+        self._counts = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def budget_for(self, max_new_tokens):
+        """Prompt tokens available when ``max_new_tokens`` must still fit in the context."""
+        budget = self.context_tokens - max_new_tokens
+        if self.prompt_budget > 0:
+            budget = min(budget, self.prompt_budget)
+        return budget
+
+    def count(self, message):
+        """Tokens this message adds to the rendered prompt."""
+        key = (message["role"], message["content"])
+        count = self._counts.get(key)
+        if count is not None:
+            self._counts.move_to_end(key)
+            self.hits += 1
+            return count
+        self.misses += 1
+        count = len(self.tokenizer.apply_chat_template([message]))
+        self._counts[key] = count
+        while len(self._counts) > self.max_entries:
+            self._counts.popitem(last=False)
+        return count
+
+    def fit(self, messages, budget):
+        """Drop the oldest middle turns until the history fits in ``budget`` tokens."""
+        counts = [self.count(m) for m in messages]
+        system = 0
+        while system < len(messages) - 1 and messages[system]["role"] == "system":
+            system += 1
+        latest = len(messages) - 1
+
+        total = sum(counts)
+        start = system
+        while True:
+            while total > budget and start < latest:
+                total -= counts[start]
+                start += 1
+            # Don't open the kept history with a reply whose question was dropped
+            while start > system and start < latest and messages[start]["role"] == "assistant":
+                total -= counts[start]
+                start += 1
+            kept = messages[:system] + messages[start:]
+            # Per-message counts miss how the template joins turns, so check the real prompt
+            prompt_tokens = len(self.tokenizer.apply_chat_template(kept))
+            if prompt_tokens <= budget or start >= latest:
+                break
+            total -= counts[start]
+            start += 1
+
+        if prompt_tokens > budget:
+            raise PromptTooLongError(
+                f"Prompt needs {prompt_tokens} tokens but only {budget} fit in the context window"
+            )
+
+        dropped = sum(counts[system:start])
+        metrics.HISTORY_DROPPED_TOKENS.observe(dropped)
+        return FittedHistory(
+            messages=kept,
+            prompt_tokens=prompt_tokens,
+            dropped_tokens=dropped,
+            dropped_messages=start - system,
+        )
+
+    def stats(self):
+        return {"cached_counts": len(self._counts), "hits": self.hits, "misses": self.misses}
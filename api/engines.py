@@ -0,0 +1,270 @@
+# api/engines.py
+"""Inference engines: how the serving model is loaded and run.
+
+``torch`` runs the transformers model in eager PyTorch. ``onnx`` exports the
+merged checkpoint to ONNX once and runs it with ONNX Runtime's CPU execution
+provider, keeping the KV cache between decode steps. The inference workers
+hand the engine to the routines in generation.py and speculative.py, which
+run every forward pass through ``prefill``/``decode_step``/``extend`` and
+every generation through ``generate``; features built on PyTorch's
+DynamicCache or on PEFT are only available where the engine lists them.
+"""
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import torch
+from transformers import DynamicCache
+
+import settings
+from model_loader import (
+    current_rss_mb,
+    load_adapter_model,
+    load_model_and_tokenizer,
+    load_tokenizer,
+    peak_rss_mb,
+    read_merge_info,
+    serving_adapters,
+    usable_merged_artifact,
+)
+
+# Written next to an exported ONNX model; records which merged checkpoint it came from
+ONNX_INFO_FILE = "onnx_info.json"
+
+# Features that need a DynamicCache (crop and reuse) or PEFT adapter swapping
+PREFIX_CACHE = "prefix_cache"
+SESSION_CACHE = "session_cache"
+SPECULATIVE = "speculative"
+ADAPTERS = "adapters"
+
+
+@dataclass
+class DecodeState:
+    """KV cache of a single sequence and how many tokens it covers."""
+
+    past_key_values: object
+    length: int
+
+
+class Engine(ABC):
+    """Loads the serving model and runs prefill, decode steps and whole generations.
+
+    Only engines listing ``SPECULATIVE`` can ``rewind`` a decode state.
+    """
+
+    name = None
+    features = frozenset()
+
+    def __init__(self, adapter_path, base_model, merged_path, precision="fp32", adapters_dir="",
+                 default_adapter=None, onnx_path=None, threads=0):
+        self.adapter_path = adapter_path
+        self.base_model = base_model
+        self.merged_path = merged_path
+        self.precision = precision
+        self.adapters_dir = adapters_dir
+        self.default_adapter = default_adapter
+        self.onnx_path = onnx_path
+        self.threads = threads
+        self.model = None
+        self.tokenizer = None
+        self.info = {}
+
+    def supports(self, feature):
+        return feature in self.features
+
+    @property
+    def device(self):
+        return self.model.device
+
+    @abstractmethod
+    def load(self):
+        """Load the model (blocking). Returns ``(model, tokenizer, info)``."""
+
+    def adopt(self, model, tokenizer, info):
+        """Serve a model this engine loaded in another process (see serve.py)."""
+        self.model, self.tokenizer, self.info = model, tokenizer, info
+
+    def new_cache(self):
+        """Empty KV cache to start a sequence from; None lets the model create its own."""
+        return None
+
+    def prefill(self, prompt_ids, state=None):
+        """Run the prompt, or the part of it after ``state``; returns the next-token logits and the decode state."""
+        logits, state = self.extend(prompt_ids, state or DecodeState(self.new_cache(), 0))
+        return logits[-1], state
+
+    def decode_step(self, token_id, state):
+        """Feed one token after ``state``; returns the next-token logits and the new state."""
+        logits, state = self.extend([token_id], state)
+        return logits[-1], state
+
+    def extend(self, token_ids, state):
+        """Feed several tokens after ``state`` in one forward pass.
+
+        Returns the logits at every fed position (one row per token) and the
+        new state; speculative decoding verifies a whole draft this way.
+        """
+        length = state.length + len(token_ids)
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=torch.tensor([list(token_ids)], device=self.device),
+                attention_mask=torch.ones(1, length, dtype=torch.long, device=self.device),
+                position_ids=torch.arange(state.length, length, device=self.device).unsqueeze(0),
+                past_key_values=state.past_key_values,
+                use_cache=True,
+            )
+        return outputs.logits[0], DecodeState(outputs.past_key_values, length)
+
+    def generate(self, input_ids, **kwargs):
+        with torch.no_grad():
+            return self.model.generate(input_ids, **kwargs)
+
+    def _loaded(self, model, tokenizer, info):
+        self.model, self.tokenizer = model, tokenizer
+        self.info = dict(info, engine=self.name)
+        return self.model, self.tokenizer, self.info
+
+
+class TorchEngine(Engine):
+    """Eager PyTorch: the merged (or runtime-merged) model, or PEFT adapters on the base model."""
+
+    name = "torch"
+    features = frozenset({PREFIX_CACHE, SESSION_CACHE, SPECULATIVE, ADAPTERS})
+
+    def load(self):
+        if self.adapters_dir:
+            print(f"Adapters: {self.adapters_dir} (default {self.adapter_path})")
+            return self._loaded(*load_adapter_model(
+                self.base_model,
+                serving_adapters(self.adapters_dir, self.adapter_path, self.default_adapter),
+                self.default_adapter,
+                precision=self.precision,
+            ))
+        print(f"Model path: {self.adapter_path}")
+        return self._loaded(*load_model_and_tokenizer(
+            self.adapter_path, self.base_model, self.merged_path, precision=self.precision
+        ))
+
+    def new_cache(self):
+        return DynamicCache()
+
+    def rewind(self, state, length):
+        """Keep only the first ``length`` tokens of ``state`` (e.g. to drop rejected draft tokens)."""
+        state.past_key_values.crop(length)
+        return DecodeState(state.past_key_values, length)
+
+
+class OnnxEngine(Engine):
+    """ONNX Runtime on the CPU execution provider, exported from the merged checkpoint.
+
+    The export is written to ``onnx_path`` on first start and reused for as
+    long as the merged checkpoint it was built from is unchanged. Past
+    key/values are plain tensors fed back to the session, so they can't be
+    cropped or shared the way the PyTorch features expect.
+    """
+
+    name = "onnx"
+    features = frozenset()
+
+    def load(self):
+        if self.adapters_dir:
+            raise ValueError("The onnx engine serves one merged model; unset ADAPTERS_DIR or use the torch engine")
+        if self.precision != "fp32":
+            raise ValueError(f"The onnx engine runs the exported fp32 graph, not {self.precision}")
+        try:
+            import onnxruntime
+            from optimum.onnxruntime import ORTModelForCausalLM
+        except ImportError as e:
+            raise ImportError("The onnx engine needs optimum[onnxruntime] installed") from e
+
+        start = time.perf_counter()
+        if not usable_onnx_export(self.onnx_path, self.merged_path):
+            if not usable_merged_artifact(self.merged_path, self.adapter_path):
+                raise FileNotFoundError(
+                    f"No merged checkpoint at {self.merged_path} to export; run api/merge_model.py first"
+                )
+            export_onnx(self.merged_path, self.onnx_path)
+
+        options = onnxruntime.SessionOptions()
+        if self.threads > 0:
+            options.intra_op_num_threads = self.threads
+        print(f"Loading ONNX model from {self.onnx_path}...")
+        model = ORTModelForCausalLM.from_pretrained(
+            self.onnx_path,
+            provider="CPUExecutionProvider",
+            session_options=options,
+            use_cache=True,
+            use_io_binding=False,
+        )
+        info = {
+            "source": "onnx",
+            "precision": self.precision,
+            "load_seconds": round(time.perf_counter() - start, 2),
+            "rss_mb": round(current_rss_mb(), 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        print(f"ONNX model loaded in {info['load_seconds']}s "
+              f"(RSS {info['rss_mb']} MB, peak {info['peak_rss_mb']} MB)")
+        return self._loaded(model, load_tokenizer(self.onnx_path), info)
+
+
+def usable_onnx_export(onnx_path, merged_path):
+    """True if onnx_path holds an export of the current merged checkpoint."""
+    info_path = os.path.join(onnx_path, ONNX_INFO_FILE) if onnx_path else None
+    if info_path is None or not os.path.exists(info_path):
+        return False
+    with open(info_path, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    current = read_merge_info(merged_path)
+    # Without the merged checkpoint there is nothing newer to export from
+    if current is not None and info.get("merge_info") != current:
+        print(f"ONNX export at {onnx_path} was built from a different merged checkpoint, re-exporting")
+        return False
+    return True
+
+
+def export_onnx(merged_path, onnx_path):
+    """Export the merged checkpoint to ONNX with past key/value inputs and outputs."""
+    from optimum.onnxruntime import ORTModelForCausalLM
+
+    start = time.perf_counter()
+    print(f"Exporting {merged_path} to ONNX at {onnx_path}...")
+    model = ORTModelForCausalLM.from_pretrained(merged_path, export=True, use_cache=True)
+    os.makedirs(onnx_path, exist_ok=True)
+    model.save_pretrained(onnx_path)
+    load_tokenizer(merged_path).save_pretrained(onnx_path)
+    info = {
+        "merged_path": os.path.abspath(merged_path),
+        "merge_info": read_merge_info(merged_path),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(onnx_path, ONNX_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    print(f"Exported in {time.perf_counter() - start:.1f}s")
+
+
+ENGINES = {engine.name: engine for engine in (TorchEngine, OnnxEngine)}
+
+
+def create_engine(name, **kwargs):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown inference engine {name!r}, expected one of {', '.join(ENGINES)}")
+    return ENGINES[name](**kwargs)
+
+
+def from_settings():
+    """The engine selected by INFERENCE_ENGINE, configured from the environment."""
+    return create_engine(
+        settings.INFERENCE_ENGINE,
+        adapter_path=settings.MODEL_PATH,
+        base_model=settings.BASE_MODEL,
+        merged_path=settings.MERGED_MODEL_PATH,
+        precision=settings.INFERENCE_PRECISION,
+        adapters_dir=settings.ADAPTERS_DIR,
+        default_adapter=settings.DEFAULT_ADAPTER_NAME,
+        onnx_path=settings.ONNX_MODEL_PATH,
+        threads=settings.ONNX_THREADS,
+    )
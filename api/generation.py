@@ -0,0 +1,514 @@
+# api/generation.py
+"""Generation routines executed on the inference worker threads.
+
+Each routine gets the serving engine (see engines.py) and runs its forward
+passes and ``generate`` calls through it.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from typing import Tuple
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+import metrics
+import settings
+import speculative
+from prefix_cache import common_prefix_length
+
+# The prompt is rendered without a generation prompt, so replies open with this marker
+ASSISTANT_MARKER = "<|assistant|>"
+# Chat-template markers that open a new turn; the reply is over once one appears
+TURN_MARKERS = ("<|user|>", "<|system|>", ASSISTANT_MARKER)
+
+
+@dataclass(frozen=True)
+class GenerationParams:
+    """Per-request generation settings, already clamped to the server limits."""
+
+    max_new_tokens: int = settings.DEFAULT_MAX_NEW_TOKENS
+    temperature: float = settings.DEFAULT_TEMPERATURE
+    top_p: float = 1.0
+    stop: Tuple[str, ...] = ()
+
+    @property
+    def do_sample(self):
+        return self.temperature > 0
+
+    def sampling_key(self):
+        """Rows with equal sampling keys can share one generate call."""
+        if not self.do_sample:
+            return ("greedy",)
+        return ("sample", self.temperature, self.top_p)
+
+    def sampling_kwargs(self):
+        if not self.do_sample:
+            return {"do_sample": False}
+        return {"do_sample": True, "temperature": self.temperature, "top_p": self.top_p}
+
+    def as_dict(self):
+        return {
+            "max_new_tokens": self.max_new_tokens,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "do_sample": self.do_sample,
+            "stop": list(self.stop),
+        }
+
+
+def resolve_params(max_new_tokens=None, temperature=None, top_p=None, stop=None):
+    """Fill in server defaults and clamp requested values to the configured limits."""
+    if max_new_tokens is None:
+        max_new_tokens = settings.DEFAULT_MAX_NEW_TOKENS
+    max_new_tokens = min(max(1, max_new_tokens), settings.MAX_NEW_TOKENS_LIMIT)
+
+    if temperature is None:
+        temperature = settings.DEFAULT_TEMPERATURE
+    temperature = min(max(0.0, temperature), settings.MAX_TEMPERATURE)
+
+    if top_p is None or top_p <= 0:
+        top_p = 1.0
+    top_p = min(top_p, 1.0)
+
+    stop = tuple(
+        s[:settings.MAX_STOP_LENGTH]
+        for s in (stop or [])[:settings.MAX_STOP_SEQUENCES]
+        if s
+    )
+    return GenerationParams(max_new_tokens, round(temperature, 4), round(top_p, 4), stop)
+
+
+def reply_start(text):
+    """Where the reply body starts: past leading whitespace and the assistant marker
+    the model writes itself, and past the whitespace after that marker."""
+    start = len(text) - len(text.lstrip())
+    if text.startswith(ASSISTANT_MARKER, start):
+        start += len(ASSISTANT_MARKER)
+        start = len(text) - len(text[start:].lstrip())
+    return start
+
+
+def truncate_reply(text, stop=()):
+    """Cut a decoded reply at the first stop string or chat-template turn marker.
+
+    Returns ``(text, stopped)``. Markers are only looked for in the reply body
+    (see reply_start), so the assistant marker it opens with does not count as
+    a stop.
+    """
+    body_start = reply_start(text)
+    cut = None
+    for marker in TURN_MARKERS + tuple(stop):
+        index = text.find(marker, body_start)
+        if index != -1 and (cut is None or index < cut):
+            cut = index
+    if cut is None:
+        return text, False
+    return text[:cut], True
+
+
+def strip_assistant_marker(text):
+    """Drop the assistant marker the model writes at the start of its reply."""
+    text = text.strip()
+    if text.startswith(ASSISTANT_MARKER):
+        text = text[len(ASSISTANT_MARKER):].lstrip()
+    return text
+
+
+def partial_marker_length(text, markers):
+    """Length of the longest end of ``text`` that could still grow into one of ``markers``."""
+    longest = 0
+    for marker in markers:
+        for length in range(min(len(marker) - 1, len(text)), longest, -1):
+            if text.endswith(marker[:length]):
+                longest = length
+                break
+    return longest
+
+
+class StopSequenceCriteria(StoppingCriteria):
+    """Marks each row done once it reaches its own token limit, a stop string or EOS,
+    or once its caller has cancelled or run out of time.
+
+    Rows may carry different limits and stop strings; generate() runs to the
+    largest limit in the batch but stops as soon as every row is done.
+    """
+
+    def __init__(self, tokenizer, prompt_length, row_params, controls=None):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.row_params = row_params
+        self.controls = controls or [None] * len(row_params)
+        self.done = [False] * len(row_params)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids[:, self.prompt_length:]
+        for row, params in enumerate(self.row_params):
+            if self.done[row]:
+                continue
+            tokens = generated[row]
+            control = self.controls[row]
+            if control is not None and control.should_stop():
+                self.done[row] = True
+            elif tokens.shape[0] >= params.max_new_tokens:
+                self.done[row] = True
+            elif (tokens == self.tokenizer.eos_token_id).any():
+                self.done[row] = True
+            else:
+                text = self.tokenizer.decode(tokens, skip_special_tokens=True)
+                self.done[row] = truncate_reply(text, params.stop)[1]
+        return torch.tensor(self.done, dtype=torch.bool, device=input_ids.device)
+
+
+class FirstTokenTimer(StoppingCriteria):
+    """Never stops generation; notes when the first new token exists (the end of prefill)."""
+
+    def __init__(self):
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return False
+
+
+def completion_length(tokens, eos_token_id):
+    """Generated tokens up to and including the first EOS (the rest is padding)."""
+    eos = (tokens == eos_token_id).nonzero()
+    if len(eos):
+        return int(eos[0]) + 1
+    return int(tokens.shape[0])
+
+
+def generate_batch(engine, tokenizer, items, controls=None, prefix_cache=None, drafter=None):
+    """Generate one reply per ``(messages, params)`` item with a single left-padded generate call.
+
+    Items in one batch share the same sampling settings; token limits, stop
+    strings and cancellation (``controls``) are applied per row. With a
+    ``drafter``, a greedy batch of one is decoded speculatively instead.
+    """
+    conversations = [messages for messages, _ in items]
+    row_params = [params for _, params in items]
+
+    # Tokenize each conversation with the chat template
+    with metrics.StageTimer("chat_template"):
+        prompts = [tokenizer.apply_chat_template(messages) for messages in conversations]
+
+        # The tokenizer pads on the left so every prompt ends where generation starts
+        inputs = tokenizer.pad({"input_ids": prompts}, padding=True, return_tensors="pt")
+
+    input_ids = inputs["input_ids"].to(engine.device)
+    attention_mask = inputs["attention_mask"].to(engine.device)
+    prompt_length = input_ids.shape[1]
+
+    started_at = time.perf_counter()
+    generate_kwargs = row_params[0].sampling_kwargs()
+    # A cached prefix only lines up with an unpadded prompt, so batches of one
+    if prefix_cache is not None and len(conversations) == 1:
+        past_key_values = prefix_cache.lookup(engine, tokenizer, conversations[0], prompts[0])
+        if past_key_values is not None:
+            generate_kwargs["past_key_values"] = past_key_values
+
+    first_token = FirstTokenTimer()
+    stop_criteria = StopSequenceCriteria(tokenizer, prompt_length, row_params, controls)
+    if drafter is not None and len(conversations) == 1 and not row_params[0].do_sample:
+        # Speculative decoding verifies greedy choices, so sampled batches use generate()
+        result = speculative.speculative_generate(
+            engine,
+            prompts[0],
+            drafter,
+            row_params[0].max_new_tokens,
+            tokenizer.eos_token_id,
+            should_stop=lambda ids: bool(stop_criteria(torch.tensor([ids]), None)[0]),
+            past_key_values=generate_kwargs.get("past_key_values"),
+            on_first_token=lambda: first_token(None, None),
+        )
+        outputs = result.sequences
+        speculative.stats.record(result.steps, outputs.shape[1] - prompt_length, result.drafted, result.accepted)
+    else:
+        outputs = engine.generate(
+            input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=max(params.max_new_tokens for params in row_params),
+            pad_token_id=tokenizer.pad_token_id,
+            stopping_criteria=StoppingCriteriaList([first_token, stop_criteria]),
+            **generate_kwargs
+        )
+    finished_at = time.perf_counter()
+
+    # Split the batch back into one decoded reply per caller
+    replies = []
+    completion_tokens = []
+    with metrics.StageTimer("detokenize"):
+        for row, params in zip(outputs, row_params):
+            tokens = row[prompt_length:prompt_length + params.max_new_tokens]
+            completion_tokens.append(completion_length(tokens, tokenizer.eos_token_id))
+            text = tokenizer.decode(tokens, skip_special_tokens=True)
+            replies.append(strip_assistant_marker(truncate_reply(text, params.stop)[0]))
+
+    metrics.observe_generation(
+        started_at,
+        first_token.first_token_at,
+        finished_at,
+        [len(prompt) for prompt in prompts],
+        completion_tokens,
+    )
+    return replies
+
+
+class CancelledCriteria(StoppingCriteria):
+    """Stops generation as soon as the job is cancelled or its deadline passes."""
+
+    def __init__(self, control):
+        self.control = control
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.control.should_stop()
+
+
+class TokenStreamer(BaseStreamer):
+    """Forwards decoded text deltas from a worker thread to an asyncio.Queue.
+
+    Items are ``("token", text)`` tuples followed by a single ``("end", None)``.
+    Only the end of the text that could still grow into a stop string or turn
+    marker is held back, and the stream ends at the first one. The assistant
+    marker the reply opens with is stripped before anything is sent, as for
+    session replies. Arrival times of the generated tokens, and when the first
+    text went out, are kept for latency reporting.
+    """
+
+    def __init__(self, tokenizer, loop, queue, stop=()):
+        self.tokenizer = tokenizer
+        self.loop = loop
+        self.queue = queue
+        self.stop = tuple(stop)
+        self.markers = TURN_MARKERS + self.stop
+        self.longest_marker = max(len(marker) for marker in self.markers)
+        self.stopped = threading.Event()
+        self.token_ids = []
+        self.token_times = []
+        self.first_text_at = None
+        # The reply body; until its start is known the decoded text is kept in _head
+        self.text = ""
+        self.decode_seconds = 0.0
+        self._head = ""
+        self._body_started = False
+        self._searched = 0
+        self._emitted = 0
+        self._prefix_offset = 0
+        self._read_offset = 0
+        self._prompt_seen = False
+        self._ended = False
+
+    def put(self, value):
+        # generate() passes the prompt first; only generated tokens are streamed
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        if self.stopped.is_set():
+            return
+        self.token_ids.extend(value.reshape(-1).tolist())
+        self.token_times.append(time.perf_counter())
+
+        decode_start = time.perf_counter()
+        delta = self._decode_delta()
+        self.decode_seconds += time.perf_counter() - decode_start
+        if not delta:
+            return
+
+        if not self._body_started:
+            self._head += delta
+            start = reply_start(self._head)
+            # Wait until the head can no longer be (the start of) the assistant marker
+            if start == len(self._head) or ASSISTANT_MARKER.startswith(self._head.lstrip()):
+                return
+            self._body_started = True
+            delta = self._head[start:]
+        self.text += delta
+
+        # Only the new text, and a marker's length before it, can hold a new match
+        search_from = max(0, self._searched - self.longest_marker + 1)
+        self._searched = len(self.text)
+        cut = None
+        for marker in self.markers:
+            index = self.text.find(marker, search_from)
+            if index != -1 and (cut is None or index < cut):
+                cut = index
+        if cut is not None:
+            self.text = self.text[:cut].rstrip()
+            self.stopped.set()
+            self._flush(len(self.text))
+            return
+
+        # Replies are stripped, so trailing whitespace waits for the text after it
+        upto = len(self.text) - partial_marker_length(self.text, self.markers)
+        while upto > self._emitted and self.text[upto - 1].isspace():
+            upto -= 1
+        self._flush(upto)
+
+    def end(self):
+        if not self._ended:
+            self._ended = True
+            if self._body_started:
+                self.text = self.text.rstrip()
+            else:
+                self.text = strip_assistant_marker(self._head)
+            self._flush(len(self.text))
+            self._emit(("end", None))
+
+    def _decode_delta(self):
+        """Text the newest tokens add, decoding only the last few ids.
+
+        Decoding from the token before the new ones keeps the spacing
+        detokenizers derive from context; a delta that ends mid-character
+        waits for the tokens that complete it.
+        """
+        ids = self.token_ids
+        prefix = self.tokenizer.decode(ids[self._prefix_offset:self._read_offset], skip_special_tokens=True)
+        text = self.tokenizer.decode(ids[self._prefix_offset:], skip_special_tokens=True)
+        if len(text) <= len(prefix) or text.endswith("\ufffd"):
+            return ""
+        self._prefix_offset = self._read_offset
+        self._read_offset = len(ids)
+        return text[len(prefix):]
+
+    def _flush(self, upto):
+        if upto > self._emitted:
+            if self.first_text_at is None:
+                self.first_text_at = time.perf_counter()
+            self._emit(("token", self.text[self._emitted:upto]))
+            self._emitted = upto
+
+    def _emit(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+class StreamerStoppedCriteria(StoppingCriteria):
+    """Stops generation once the streamer has seen a stop string."""
+
+    def __init__(self, streamer):
+        self.streamer = streamer
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.streamer.stopped.is_set()
+
+
+def stream_reply(engine, tokenizer, chat_messages, params, streamer, control, prefix_cache=None):
+    """Generate a single reply, pushing tokens through the streamer as they are produced."""
+    try:
+        with metrics.StageTimer("chat_template"):
+            inputs = tokenizer.apply_chat_template(
+                chat_messages,
+                return_tensors="pt"
+            ).to(engine.device)
+
+        started_at = time.perf_counter()
+        generate_kwargs = params.sampling_kwargs()
+        if prefix_cache is not None:
+            past_key_values = prefix_cache.lookup(engine, tokenizer, chat_messages, inputs[0].tolist())
+            if past_key_values is not None:
+                generate_kwargs["past_key_values"] = past_key_values
+
+        engine.generate(
+            inputs,
+            attention_mask=torch.ones_like(inputs),
+            max_new_tokens=params.max_new_tokens,
+            pad_token_id=tokenizer.pad_token_id,
+            streamer=streamer,
+            stopping_criteria=StoppingCriteriaList([
+                CancelledCriteria(control),
+                StreamerStoppedCriteria(streamer),
+            ]),
+            **generate_kwargs
+        )
+        finished_at = time.perf_counter()
+
+        first_token_at = streamer.token_times[0] if streamer.token_times else None
+        metrics.observe_generation(
+            started_at, first_token_at, finished_at, [inputs.shape[1]], [len(streamer.token_ids)]
+        )
+        metrics.STAGE_SECONDS.labels("detokenize").observe(streamer.decode_seconds)
+    finally:
+        streamer.end()
+    return streamer.text
+
+
+@dataclass
+class SessionTurn:
+    """Result of one session turn; ``cache`` covers the first ``len(cached_ids)`` tokens."""
+
+    reply: str
+    cache: object
+    cached_ids: Tuple[int, ...]
+    prompt_tokens: int
+    reused_tokens: int
+
+
+def generate_session_turn(engine, tokenizer, messages, params, cache, cached_ids, control, prefix_cache=None):
+    """Generate the next reply of a session, starting from the KV cache of its last turn.
+
+    The cache is cut back to the longest run of tokens it shares with the new
+    prompt, so only the new turn (and anything that re-tokenized differently)
+    is prefilled. Without a usable session cache the shared prefix cache is
+    tried instead.
+    """
+    with metrics.StageTimer("chat_template"):
+        prompt_ids = tokenizer.apply_chat_template(messages)
+
+    reused = 0
+    if cache is not None:
+        # Leave at least one token for generate() to prefill
+        reused = min(common_prefix_length(cached_ids, prompt_ids), len(prompt_ids) - 1)
+        if reused <= 0:
+            cache = None
+        elif reused < cache.get_seq_length():
+            cache.crop(reused)
+    if cache is None and prefix_cache is not None:
+        cache = prefix_cache.lookup(engine, tokenizer, messages, prompt_ids)
+    if cache is None:
+        cache = engine.new_cache()
+
+    input_ids = torch.tensor([prompt_ids], device=engine.device)
+    started_at = time.perf_counter()
+    first_token = FirstTokenTimer()
+    outputs = engine.generate(
+        input_ids,
+        attention_mask=torch.ones_like(input_ids),
+        max_new_tokens=params.max_new_tokens,
+        pad_token_id=tokenizer.pad_token_id,
+        past_key_values=cache,
+        stopping_criteria=StoppingCriteriaList([
+            first_token,
+            StopSequenceCriteria(tokenizer, len(prompt_ids), [params], [control]),
+        ]),
+        **params.sampling_kwargs()
+    )
+    finished_at = time.perf_counter()
+
+    tokens = outputs[0][len(prompt_ids):]
+    with metrics.StageTimer("detokenize"):
+        text = tokenizer.decode(tokens, skip_special_tokens=True)
+        reply = strip_assistant_marker(truncate_reply(text, params.stop)[0])
+
+    metrics.observe_generation(
+        started_at,
+        first_token.first_token_at,
+        finished_at,
+        [len(prompt_ids)],
+        [completion_length(tokens, tokenizer.eos_token_id)],
+    )
+    # The last sampled token is never fed back, so the cache stops one short of outputs
+    cached_ids = tuple(outputs[0][:cache.get_seq_length()].tolist())
+    return SessionTurn(reply, cache, cached_ids, len(prompt_ids), reused)
+
+
+def generate_stateless_turn(engine, tokenizer, messages, params, cache, cached_ids, control, prefix_cache=None):
+    """Session turn for engines whose KV cache can't be kept between turns.
+
+    The whole history is prefilled every turn; the session keeps no cache.
+    """
+    with metrics.StageTimer("chat_template"):
+        prompt_tokens = len(tokenizer.apply_chat_template(messages))
+    reply = generate_batch(engine, tokenizer, [(messages, params)], [control])[0]
+    return SessionTurn(reply, None, (), prompt_tokens, 0)
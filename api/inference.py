@@ -0,0 +1,561 @@
+# api/inference.py
+"""Inference worker threads that run generation off the asyncio event loop."""
+import asyncio
+import collections
+import os
+import threading
+import time
+
+import torch
+
+import metrics
+
+
+def available_cores():
+    """Number of cores this process may run on (respects CPU pinning)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class AdmissionError(Exception):
+    """Raised when a job is refused at submission; ``retry_after`` is in seconds."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFullError(AdmissionError):
+    """Raised when the inference job queue is at capacity."""
+
+
+class DeadlineUnreachableError(AdmissionError):
+    """Raised when the estimated queue wait already exceeds the job's deadline."""
+
+
+class DeadlineExceededError(Exception):
+    """Set on a job's future when its deadline passed before it could finish."""
+
+
+class JobControl:
+    """Deadline and cancellation flag shared between a request and its job.
+
+    Workers check it before starting a job and between decoding steps, so a
+    job whose caller went away or ran out of time stops using the CPU.
+    """
+
+    def __init__(self, timeout=None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def should_stop(self):
+        return self.cancelled() or self.expired()
+
+    def extend(self, other):
+        """Move the deadline out to ``other``'s if that is later (no deadline is latest)."""
+        if self.deadline is not None and (other.deadline is None or other.deadline > self.deadline):
+            self.deadline = other.deadline
+
+
+# Priority lanes, highest first; "high" is for short prompts and health probes
+LANES = ("high", "normal")
+# Tenant of jobs submitted without one
+DEFAULT_TENANT = "anonymous"
+
+
+class Job:
+    """A unit of work for the inference workers.
+
+    ``batch_key`` groups jobs that may share one forward pass; jobs with a
+    ``None`` key always run on their own. ``tenant`` and ``lane`` decide when
+    the job gets its turn.
+    """
+
+    __slots__ = ("fn", "payload", "batch_key", "future", "loop", "control", "enqueued_at", "tenant", "lane")
+
+    def __init__(self, fn, payload, batch_key, future, loop, control, tenant=DEFAULT_TENANT, lane="normal"):
+        self.fn = fn
+        self.payload = payload
+        self.batch_key = batch_key
+        self.future = future
+        self.loop = loop
+        self.control = control
+        self.enqueued_at = time.monotonic()
+        self.tenant = tenant
+        self.lane = lane
+
+
+class JobQueue:
+    """Bounded fair-share queue that can hand out batches of compatible jobs.
+
+    Jobs wait in per-tenant FIFOs inside priority lanes. The high lane is
+    served first, but after ``high_burst`` consecutive high picks a waiting
+    normal job gets a turn so the normal lane can't starve. Within a lane
+    tenants take turns round-robin; a tenant with weight ``w`` gets up to ``w``
+    jobs per turn. A single tenant may hold at most ``max_per_tenant`` queued
+    jobs, so one busy channel is refused before it fills the whole queue.
+    """
+
+    def __init__(self, max_size, max_per_tenant=0, weights=None, high_burst=4):
+        self.max_size = max_size
+        self.max_per_tenant = max_per_tenant
+        self.weights = dict(weights or {})
+        self.high_burst = max(1, high_burst)
+        # lane -> tenant -> deque of jobs; dict order is the round-robin order
+        self._lanes = {lane: collections.OrderedDict() for lane in LANES}
+        self._credits = {lane: {} for lane in LANES}
+        self._tenant_sizes = collections.Counter()
+        self._size = 0
+        self._high_streak = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, job):
+        with self._cond:
+            if self._size >= self.max_size:
+                raise QueueFullError("Inference queue is full")
+            if self.max_per_tenant and self._tenant_sizes[job.tenant] >= self.max_per_tenant:
+                raise QueueFullError("Too many queued requests for this tenant")
+            tenants = self._lanes[job.lane]
+            tenants.setdefault(job.tenant, collections.deque()).append(job)
+            self._tenant_sizes[job.tenant] += 1
+            self._size += 1
+            # Wake idle workers as well as any worker still gathering a batch
+            self._cond.notify_all()
+
+    def has_room(self, tenant):
+        """True if put() would accept a job for ``tenant`` right now."""
+        with self._cond:
+            if self._size >= self.max_size:
+                return False
+            return not (self.max_per_tenant and self._tenant_sizes[tenant] >= self.max_per_tenant)
+
+    def qsize(self):
+        with self._cond:
+            return self._size
+
+    def depths(self):
+        """Queued jobs per lane and per tenant."""
+        with self._cond:
+            lanes = {lane: sum(len(jobs) for jobs in tenants.values()) for lane, tenants in self._lanes.items()}
+            return lanes, dict(self._tenant_sizes)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def take_batch(self, max_batch_size, max_wait):
+        """Block for the next job, then gather compatible jobs for up to max_wait seconds.
+
+        Returns an empty list once the queue has been closed.
+        """
+        with self._cond:
+            while not self._size and not self._closed:
+                self._cond.wait()
+            if not self._size:
+                return []
+
+            first = self._pop_next()
+            batch = [first]
+            if first.batch_key is None or max_batch_size <= 1:
+                return batch
+
+            deadline = time.monotonic() + max_wait
+            while len(batch) < max_batch_size:
+                self._drain_compatible(first, batch, max_batch_size)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= max_batch_size or remaining <= 0 or self._closed:
+                    break
+                self._cond.wait(remaining)
+            return batch
+
+    def _pick_lane(self):
+        high, normal = (self._lanes[lane] for lane in LANES)
+        if high and (not normal or self._high_streak < self.high_burst):
+            self._high_streak += 1
+            return LANES[0]
+        self._high_streak = 0
+        return LANES[1]
+
+    def _pop_next(self):
+        """Take the next job in fair-share order (caller holds the lock)."""
+        lane = self._pick_lane()
+        tenants = self._lanes[lane]
+        credits = self._credits[lane]
+        tenant, jobs = next(iter(tenants.items()))
+        job = jobs.popleft()
+        credits[tenant] = credits.get(tenant, self.weights.get(tenant, 1)) - 1
+        if not jobs:
+            del tenants[tenant]
+            credits.pop(tenant, None)
+        elif credits[tenant] <= 0:
+            # Turn used up: go to the back of the rotation
+            tenants.move_to_end(tenant)
+            del credits[tenant]
+        self._taken(job)
+        return job
+
+    def _drain_compatible(self, first, batch, max_batch_size):
+        """Fill the batch with jobs that can share ``first``'s forward pass.
+
+        Passes over the tenants in turn order, taking at most one job per
+        tenant per pass, so a spare batch slot goes to the quietest tenants first.
+        """
+        progress = True
+        while progress and len(batch) < max_batch_size:
+            progress = False
+            for lane in LANES:
+                tenants = self._lanes[lane]
+                for tenant in list(tenants):
+                    if len(batch) >= max_batch_size:
+                        return
+                    job = self._remove_compatible(tenants, tenant, first)
+                    if job is not None:
+                        batch.append(job)
+                        progress = True
+
+    def _remove_compatible(self, tenants, tenant, first):
+        jobs = tenants[tenant]
+        for job in jobs:
+            if job.fn is first.fn and job.batch_key == first.batch_key:
+                jobs.remove(job)
+                if not jobs:
+                    del tenants[tenant]
+                    self._credits[job.lane].pop(tenant, None)
+                self._taken(job)
+                return job
+        return None
+
+    def _taken(self, job):
+        self._size -= 1
+        self._tenant_sizes[job.tenant] -= 1
+        if not self._tenant_sizes[job.tenant]:
+            del self._tenant_sizes[job.tenant]
+
+
+class TenantStats:
+    """Per-tenant served/rejected counts and queue wait for the most recently seen tenants."""
+
+    def __init__(self, max_tenants=256):
+        self.max_tenants = max_tenants
+        self._tenants = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, tenant):
+        entry = self._tenants.get(tenant)
+        if entry is None:
+            entry = self._tenants[tenant] = {"served": 0, "rejected": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            while len(self._tenants) > self.max_tenants:
+                self._tenants.popitem(last=False)
+        else:
+            self._tenants.move_to_end(tenant)
+        return entry
+
+    def record_wait(self, tenant, seconds):
+        with self._lock:
+            entry = self._entry(tenant)
+            entry["served"] += 1
+            entry["wait_seconds"] += seconds
+            entry["max_wait_seconds"] = max(entry["max_wait_seconds"], seconds)
+
+    def record_rejected(self, tenant):
+        with self._lock:
+            self._entry(tenant)["rejected"] += 1
+
+    def snapshot(self, queued):
+        """Stats per tenant, merged with the live ``queued`` depth of each."""
+        with self._lock:
+            tenants = {}
+            for tenant, entry in self._tenants.items():
+                served = entry["served"]
+                tenants[tenant] = {
+                    "queued": queued.get(tenant, 0),
+                    "served": served,
+                    "rejected": entry["rejected"],
+                    "mean_wait_ms": round(entry["wait_seconds"] / served * 1000, 1) if served else None,
+                    "max_wait_ms": round(entry["max_wait_seconds"] * 1000, 1),
+                }
+        for tenant, depth in queued.items():
+            tenants.setdefault(tenant, {"queued": depth, "served": 0, "rejected": 0,
+                                        "mean_wait_ms": None, "max_wait_ms": 0.0})
+        return tenants
+
+
+class BatchStats:
+    """Running counters for the batch occupancy achieved by the workers."""
+
+    def __init__(self, max_batch_size):
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.jobs = 0
+        self.size_counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, size):
+        with self._lock:
+            self.batches += 1
+            self.jobs += size
+            self.size_counts[size] += 1
+
+    def snapshot(self):
+        with self._lock:
+            mean_size = self.jobs / self.batches if self.batches else 0.0
+            return {
+                "batches": self.batches,
+                "jobs": self.jobs,
+                "max_batch_size": self.max_batch_size,
+                "mean_batch_size": round(mean_size, 3),
+                "occupancy": round(mean_size / self.max_batch_size, 3) if self.max_batch_size else 0.0,
+                "size_histogram": {str(k): v for k, v in sorted(self.size_counts.items())},
+            }
+
+
+class InferenceExecutor:
+    """Bounded job queue served by generation threads that own the engine.
+
+    ``submit`` runs ``fn(engine, tokenizer, *args)`` on its own.
+    ``submit_batched`` queues one item for
+    ``batch_fn(engine, tokenizer, items, controls)``; a worker collects items
+    that share a ``batch_key`` for up to ``max_batch_wait`` seconds (or until
+    ``max_batch_size`` is reached) and runs them together. ``batch_fn`` must
+    return one result per item, in order, and should stop work for rows whose
+    ``JobControl`` says so.
+
+    Both must be called from the event loop and return awaitable futures, so the
+    loop stays free to answer other requests while the CPU is busy generating.
+    Jobs are scheduled fairly between ``tenant`` keys within their priority
+    ``lane`` (see ``JobQueue``).
+    Cancelling a future cancels its job's control. Submission fails fast with
+    an ``AdmissionError`` when the queue is full or the job could not start
+    before its deadline; ``submit_batched_when_room`` waits for room instead,
+    for offline work that should neither fail nor count as rejected.
+    """
+
+    def __init__(self, engine, tokenizer, num_workers=1, max_queue_size=32, threads_per_worker=0,
+                 max_batch_size=1, max_batch_wait=0.0, max_per_tenant=0, tenant_weights=None,
+                 high_burst=4):
+        self.engine = engine
+        self.tokenizer = tokenizer
+        self.num_workers = max(1, num_workers)
+        if threads_per_worker <= 0:
+            threads_per_worker = max(1, available_cores() // self.num_workers)
+        self.threads_per_worker = threads_per_worker
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_wait = max(0.0, max_batch_wait)
+        self.batch_stats = BatchStats(self.max_batch_size)
+        self._jobs = JobQueue(max_queue_size, max_per_tenant, tenant_weights, high_burst)
+        self.tenant_stats = TenantStats()
+        self._threads = []
+        # Moving average of how long one batch keeps a worker busy
+        self._batch_seconds = None
+        self.rejected = collections.Counter()
+        self.expired = 0
+        # (loop, future) of callers waiting for queue room; woken when workers take jobs
+        self._room_waiters = []
+        self._room_lock = threading.Lock()
+
+    def start(self):
+        for index in range(self.num_workers):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(index,),
+                name=f"inference-worker-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+        print(f"Started {self.num_workers} inference worker(s) "
+              f"with {self.threads_per_worker} torch thread(s) each, "
+              f"batches of up to {self.max_batch_size} within {self.max_batch_wait * 1000:.0f}ms")
+
+    def submit(self, fn, *args, control=None, tenant=None, lane="normal"):
+        """Queue a standalone job and return an asyncio future for its result."""
+        return self._enqueue(_run_single, (fn, args), None, control, tenant, lane)
+
+    def submit_batched(self, batch_fn, item, batch_key, control=None, tenant=None, lane="normal"):
+        """Queue one item for batched execution and return a future for its result."""
+        return self._enqueue(batch_fn, item, batch_key, control, tenant, lane)
+
+    async def submit_batched_when_room(self, batch_fn, item, batch_key, control=None, tenant=None, lane="normal"):
+        """Like ``submit_batched``, but wait for queue room rather than raise ``QueueFullError``.
+
+        Returns the job's result.
+        """
+        tenant = tenant or DEFAULT_TENANT
+        while True:
+            # Register before checking, so a worker taking jobs in between still wakes us
+            loop = asyncio.get_running_loop()
+            room = loop.create_future()
+            with self._room_lock:
+                self._room_waiters.append((loop, room))
+            if self._jobs.has_room(tenant):
+                room.cancel()
+                break
+            await room
+        # Nothing else runs on the loop before put(), and workers only make room
+        return await self.submit_batched(batch_fn, item, batch_key, control=control, tenant=tenant, lane=lane)
+
+    def pending(self):
+        return self._jobs.qsize()
+
+    def estimated_wait(self):
+        """Rough seconds until a newly queued job would start, from recent batch times."""
+        if self._batch_seconds is None:
+            return 0.0
+        mean_batch = max(1.0, self.batch_stats.snapshot()["mean_batch_size"])
+        batches_ahead = self.pending() / mean_batch / self.num_workers
+        return batches_ahead * self._batch_seconds
+
+    def retry_after(self):
+        return max(1, int(self.estimated_wait() + 0.999))
+
+    def stats(self):
+        stats = self.batch_stats.snapshot()
+        stats["pending"] = self.pending()
+        stats["workers"] = self.num_workers
+        stats["estimated_wait_seconds"] = round(self.estimated_wait(), 2)
+        stats["rejected"] = dict(self.rejected)
+        stats["expired"] = self.expired
+        lanes, tenants = self._jobs.depths()
+        stats["lanes"] = lanes
+        stats["tenants"] = self.tenant_stats.snapshot(tenants)
+        return stats
+
+    def shutdown(self, wait=True):
+        self._jobs.close()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def _enqueue(self, fn, payload, batch_key, control, tenant, lane):
+        if control is None:
+            control = JobControl()
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane {lane!r}, expected one of {', '.join(LANES)}")
+        tenant = tenant or DEFAULT_TENANT
+        remaining = control.remaining()
+        if remaining is not None and self.estimated_wait() > remaining:
+            self.rejected["deadline"] += 1
+            self.tenant_stats.record_rejected(tenant)
+            raise DeadlineUnreachableError("Server overloaded, request would miss its deadline",
+                                           retry_after=self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            self._jobs.put(Job(fn, payload, batch_key, future, loop, control, tenant, lane))
+        except QueueFullError as e:
+            self.rejected["queue_full"] += 1
+            self.tenant_stats.record_rejected(tenant)
+            e.retry_after = self.retry_after()
+            raise
+        # A caller that gives up (disconnect, timeout) cancels the future; pass
+        # that on to the worker so it can drop or cut short the job
+        future.add_done_callback(lambda f: control.cancel() if f.cancelled() else None)
+        self._publish_depth()
+        return future
+
+    def _publish_depth(self):
+        lanes, _ = self._jobs.depths()
+        for lane, depth in lanes.items():
+            metrics.QUEUE_DEPTH.labels(lane).set(depth)
+
+    def _worker(self, index):
+        # Intra-op threads are configured per worker thread so several
+        # workers don't oversubscribe the cores
+        torch.set_num_threads(self.threads_per_worker)
+
+        while True:
+            batch = self._jobs.take_batch(self.max_batch_size, self.max_batch_wait)
+            if not batch:
+                break
+            self._publish_depth()
+            self._wake_room_waiters()
+            picked_at = time.monotonic()
+            for job in batch:
+                waited = picked_at - job.enqueued_at
+                metrics.QUEUE_WAIT.labels(job.lane).observe(waited)
+                self.tenant_stats.record_wait(job.tenant, waited)
+            batch = [job for job in batch if self._admit(job)]
+            if not batch:
+                continue
+            if batch[0].batch_key is not None:
+                self.batch_stats.record(len(batch))
+                metrics.BATCH_SIZE.observe(len(batch))
+            started_at = time.perf_counter()
+            try:
+                with torch.no_grad():
+                    results = batch[0].fn(
+                        self.engine,
+                        self.tokenizer,
+                        [job.payload for job in batch],
+                        [job.control for job in batch],
+                    )
+            except Exception as e:
+                for job in batch:
+                    job.loop.call_soon_threadsafe(_set_exception, job.future, e)
+            else:
+                for job, result in zip(batch, results):
+                    if job.control.expired():
+                        job.loop.call_soon_threadsafe(
+                            _set_exception, job.future, DeadlineExceededError("Deadline exceeded during generation")
+                        )
+                    else:
+                        job.loop.call_soon_threadsafe(_set_result, job.future, result)
+            self._record_batch_time(time.perf_counter() - started_at)
+
+    def _wake_room_waiters(self):
+        with self._room_lock:
+            waiters, self._room_waiters = self._room_waiters, []
+        for loop, room in waiters:
+            loop.call_soon_threadsafe(_set_result, room, None)
+
+    def _admit(self, job):
+        """Drop jobs whose caller has gone away or whose deadline passed while queued."""
+        if job.future.cancelled() or job.control.cancelled():
+            return False
+        if job.control.expired():
+            self.expired += 1
+            job.loop.call_soon_threadsafe(
+                _set_exception, job.future, DeadlineExceededError("Deadline exceeded while queued")
+            )
+            return False
+        return True
+
+    def _record_batch_time(self, seconds):
+        if self._batch_seconds is None:
+            self._batch_seconds = seconds
+        else:
+            self._batch_seconds = 0.8 * self._batch_seconds + 0.2 * seconds
+
+
+def _run_single(engine, tokenizer, payloads, controls):
+    fn, args = payloads[0]
+    return [fn(engine, tokenizer, *args)]
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, exc):
+    if not future.done():
+        future.set_exception(exc)
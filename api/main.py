@@ -1,16 +1,46 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from peft import PeftModel
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Union
+import asyncio
+import collections
+import functools
+import json
 import os
-from dotenv import load_dotenv
+import sys
+import time
 import uvicorn
 
-# Load environment variables
-load_dotenv()
+# Make sibling modules importable both as `api.main` and as `main`
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import engines
+import metrics
+import settings
+import speculative
+from adapters import AdapterRegistry, UnknownAdapterError
+from inference import (
+    AdmissionError,
+    DeadlineExceededError,
+    InferenceExecutor,
+    JobControl,
+    QueueFullError,
+)
+from context_window import ContextWindow, PromptTooLongError
+from model_loader import load_draft_model
+from generation import (
+    TokenStreamer,
+    generate_batch,
+    generate_session_turn,
+    generate_stateless_turn,
+    resolve_params,
+    stream_reply,
+)
+from prefix_cache import PrefixCache
+from response_cache import ResponseCache, cache_key, is_deterministic
+from sessions import SessionBusyError, SessionNotFoundError, SessionStore
+from status import ServiceStatus
 
 app = FastAPI()
 
@@ -23,99 +53,714 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Model and tokenizer will be loaded at startup
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started_at = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep cardinality bounded
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        metrics.REQUEST_LATENCY.labels(route_path, request.method).observe(time.perf_counter() - started_at)
+        metrics.REQUESTS.labels(route_path, request.method, str(status)).inc()
+        service_status.latency.record(route_path, time.perf_counter() - started_at, status)
+
+# Model and tokenizer are loaded in the background after startup
+service_status = ServiceStatus(latency_window=settings.STATUS_LATENCY_WINDOW)
+loader_task = None
+engine = None
 model = None
 tokenizer = None
+model_info = {}
+# Set when serve.py's parent failed to load the model these workers would share
+preload_error = None
+executor = None
+prefix_cache = None
+# Set when ADAPTERS_DIR serves several LoRA adapters on one base model
+adapters = None
+context_window = None
+chat_batch_fn = generate_batch
+session_turn_fn = generate_session_turn
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_SIZE,
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    ttl=settings.RESPONSE_CACHE_TTL,
+)
+sessions = SessionStore(
+    max_bytes=settings.SESSION_CACHE_MB * 1024 * 1024,
+    ttl=settings.SESSION_TTL,
+    max_sessions=settings.SESSION_MAX_COUNT,
+)
 
 class ChatMessage(BaseModel):
     role: str
     content: str
 
-class ChatRequest(BaseModel):
+class SamplingOptions(BaseModel):
+    # Generation controls; omitted values use the server defaults, and all
+    # values are clamped to the server limits
+    max_new_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    stop: Optional[List[str]] = None
+
+    def generation_params(self):
+        return resolve_params(self.max_new_tokens, self.temperature, self.top_p, self.stop)
+
+class GenerationOptions(SamplingOptions):
+    # Seconds the caller is willing to wait; capped by MAX_REQUEST_TIMEOUT
+    timeout: Optional[float] = None
+    # Fair-share key (e.g. the Discord channel ID); requests without one share a turn
+    tenant: Optional[str] = None
+
+    def job_control(self):
+        timeout = self.timeout if self.timeout and self.timeout > 0 else settings.REQUEST_TIMEOUT
+        return JobControl(min(timeout, settings.MAX_REQUEST_TIMEOUT))
+
+class ChatRequest(GenerationOptions):
     messages: List[ChatMessage]
     model: str = "tinyllama-finetuned"
+    # Reuse (and share) a reply for byte-identical requests even when sampling
+    cache: bool = False
+
+    def prompt_chars(self):
+        return sum(len(msg.content) for msg in self.messages)
+
+class SessionCreateRequest(BaseModel):
+    # Opening messages, typically the system prompt
+    messages: List[ChatMessage] = []
+    model: str = "tinyllama-finetuned"
+
+class SessionChatRequest(GenerationOptions):
+    content: str
+
+    def prompt_chars(self):
+        # Only the new turn is prefilled when the session's KV cache is retained
+        return len(self.content)
+
+class BulkChatItem(SamplingOptions):
+    # Echoed back with the result; defaults to the item's position in the input
+    id: Optional[Union[str, int]] = None
+    messages: List[ChatMessage]
+
+class BulkChatRequest(BaseModel):
+    items: List[BulkChatItem]
+    model: str = "tinyllama-finetuned"
+    tenant: Optional[str] = None
+
+class ClientDisconnectedError(Exception):
+    """The client closed the connection before its reply was ready."""
+
+def lane(prompt_chars):
+    """Short prompts are cheap to serve, so they skip ahead of long ones."""
+    return "high" if prompt_chars <= settings.PRIORITY_PROMPT_CHARS else "normal"
+
+def use_preloaded_model(loaded_model, loaded_tokenizer, info):
+    """Serve a model loaded before startup (see serve.py) instead of loading one."""
+    global model, tokenizer, model_info
+    model = loaded_model
+    tokenizer = loaded_tokenizer
+    model_info = dict(info, loaded_by_pid=os.getpid())
+
+def use_failed_preload(error):
+    """Report a model load that failed before startup (see serve.py) instead of retrying it."""
+    global preload_error
+    preload_error = error
+
+# Warming up with the bot's system prompt also fills its prefix-cache entry
+WARMUP_MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "ping"},
+]
 
 @app.on_event("startup")
+async def start_loading():
+    global loader_task
+    print("Starting RohanAI API...")
+    # Load in the background so liveness and status checks answer meanwhile
+    loader_task = asyncio.create_task(load_model())
+
 async def load_model():
-    global model, tokenizer
+    global engine, model, tokenizer, model_info, executor, prefix_cache, chat_batch_fn, session_turn_fn
+    global context_window, adapters
+    loop = asyncio.get_running_loop()
     try:
-        model_path = os.getenv("MODEL_PATH", "./models/tinyllama-finetuned")
-        base_model = "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
-
-        print("Starting RohanAI API...")
-        print(f"Model path: {model_path}")
-
-        print("Loading tokenizer...")
-        tokenizer = AutoTokenizer.from_pretrained(base_model)
-        if tokenizer.pad_token is None:
-            tokenizer.pad_token = tokenizer.eos_token
-
-        print("Loading base model...")
-        model = AutoModelForCausalLM.from_pretrained(
-            base_model,
-            torch_dtype=torch.float32,  # Use float32 for better compatibility
-            device_map="cpu",  # Use CPU for stable deployment
-            trust_remote_code=True
+        service_status.enter("loading")
+        if preload_error is not None:
+            raise RuntimeError(preload_error)
+        engine = engines.from_settings()
+        print(f"Inference engine: {engine.name}")
+        if model is None:
+            model, tokenizer, model_info = await loop.run_in_executor(None, engine.load)
+        else:
+            print(f"Using model preloaded by process {model_info.get('loaded_by_pid')}")
+            engine.adopt(model, tokenizer, model_info)
+        metrics.MODEL_LOAD_SECONDS.set(model_info.get("load_seconds", 0))
+
+        context_window = ContextWindow(
+            tokenizer,
+            context_tokens=settings.MODEL_CONTEXT_TOKENS,
+            prompt_budget=settings.PROMPT_TOKEN_BUDGET,
         )
 
-        # Try to load fine-tuned weights if available
-        if os.path.exists(model_path):
-            print("Loading fine-tuned PEFT adapter...")
-            model = PeftModel.from_pretrained(model, model_path)
-            model = model.merge_and_unload()
-            print("Fine-tuned model loaded successfully!")
+        # Shared chat-template prefixes (the bot's system prompt) are prefilled once
+        make_prefix_cache = None
+        if settings.PREFIX_CACHE_SIZE > 0 and engine.supports(engines.PREFIX_CACHE):
+            make_prefix_cache = functools.partial(
+                PrefixCache,
+                max_entries=settings.PREFIX_CACHE_SIZE,
+                min_tokens=settings.PREFIX_CACHE_MIN_TOKENS,
+            )
+
+        if settings.DECODING_MODE != "standard" and not engine.supports(engines.SPECULATIVE):
+            print(f"The {engine.name} engine can't decode speculatively; using standard decoding")
+            settings.DECODING_MODE = "standard"
+        # Sessions without a reusable KV cache prefill their whole history each turn
+        if not engine.supports(engines.SESSION_CACHE):
+            session_turn_fn = generate_stateless_turn
+
+        draft_model = None
+        if settings.DECODING_MODE == "draft_model":
+            draft_model = await loop.run_in_executor(
+                None, load_draft_model, settings.SPECULATIVE_DRAFT_MODEL, settings.INFERENCE_PRECISION
+            )
+        drafter = speculative.make_drafter(
+            settings.DECODING_MODE,
+            num_tokens=settings.SPECULATIVE_NUM_TOKENS,
+            max_ngram=settings.SPECULATIVE_MAX_NGRAM,
+            draft_model=draft_model,
+        )
+        if settings.ADAPTERS_DIR:
+            # Each adapter changes the KV values, so each gets its own prefix cache
+            adapters = AdapterRegistry(
+                model,
+                settings.ADAPTERS_DIR,
+                settings.DEFAULT_ADAPTER_NAME,
+                max_loaded=settings.MAX_LOADED_ADAPTERS,
+                max_bytes=settings.ADAPTER_CACHE_MB * 1024 * 1024,
+                prefix_cache_factory=make_prefix_cache,
+            )
+            chat_batch_fn = adapters.batch_fn(functools.partial(generate_batch, drafter=drafter))
         else:
-            print(f"Fine-tuned model not found at {model_path}, using base model")
+            if make_prefix_cache is not None:
+                prefix_cache = make_prefix_cache()
+            chat_batch_fn = functools.partial(generate_batch, prefix_cache=prefix_cache, drafter=drafter)
+
+        # Workers hand the engine to the generation routines
+        executor = InferenceExecutor(
+            engine,
+            tokenizer,
+            num_workers=settings.INFERENCE_WORKERS,
+            max_queue_size=settings.INFERENCE_QUEUE_SIZE,
+            threads_per_worker=settings.TORCH_THREADS_PER_WORKER,
+            max_batch_size=settings.BATCH_MAX_SIZE,
+            max_batch_wait=settings.BATCH_MAX_WAIT_MS / 1000,
+            max_per_tenant=settings.TENANT_MAX_QUEUED,
+            tenant_weights=settings.TENANT_WEIGHTS,
+            high_burst=settings.HIGH_PRIORITY_BURST,
+        )
+        executor.start()
 
-        model.eval()
+        if settings.WARMUP_ON_START:
+            service_status.enter("warming")
+            latency_ms = await run_probe(WARMUP_MESSAGES, settings.WARMUP_TOKENS, timeout=None)
+            print(f"Warmup generation took {latency_ms:.0f}ms")
+        service_status.enter("ready")
         print("RohanAI API is ready!")
 
     except Exception as e:
         print(f"Error loading model: {str(e)}")
-        print("API will use fallback responses")
+        service_status.enter("failed", error=str(e))
+        if executor is not None:
+            executor.shutdown(wait=False)
         model = None
         tokenizer = None
+        executor = None
+
+@app.on_event("shutdown")
+async def stop_executor():
+    if loader_task is not None and not loader_task.done():
+        loader_task.cancel()
+    if executor is not None:
+        executor.shutdown(wait=False)
 
 @app.get("/")
 async def health_check():
-    return {"status": "ok", "message": "API is running"}
+    status = "ok" if service_status.ready else service_status.phase
+    return {"status": status, "message": "API is running"}
 
-@app.post("/api/chat")
-async def chat_endpoint(request: ChatRequest):
-    if model is None or tokenizer is None:
+@app.get("/health/live")
+async def liveness():
+    """The process is up; only a failed model load warrants a restart."""
+    if service_status.failed:
+        return JSONResponse({"status": "failed", "error": service_status.error}, status_code=503)
+    return {"status": "alive", "phase": service_status.phase}
+
+@app.get("/health/ready")
+async def readiness():
+    """Route traffic here only once the model is loaded and warmed up."""
+    if not service_status.ready:
+        return JSONResponse(
+            {"status": service_status.phase},
+            status_code=503,
+            headers={"Retry-After": str(settings.NOT_READY_RETRY_AFTER)},
+        )
+    return {"status": "ready"}
+
+@app.get("/api/status")
+async def service_status_endpoint():
+    status = service_status.snapshot()
+    status.update({
+        "pid": os.getpid(),
+        "engine": engine.name if engine is not None else settings.INFERENCE_ENGINE,
+        "model": model_info,
+        "precision": settings.INFERENCE_PRECISION,
+        "decoding_mode": settings.DECODING_MODE,
+        "adapter": adapters.stats() if adapters is not None else {"default": settings.MODEL_PATH},
+        "pending": executor.pending() if executor is not None else 0,
+    })
+    return status
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/api/stats")
+async def inference_stats():
+    if executor is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
-    
+    stats = executor.stats()
+    stats["model"] = model_info
+    if prefix_cache is not None:
+        stats["prefix_cache"] = prefix_cache.stats()
+    if adapters is not None:
+        stats["adapters"] = adapters.stats()
+    stats["response_cache"] = response_cache.stats()
+    stats["sessions"] = sessions.stats()
+    stats["context_window"] = context_window.stats()
+    if settings.DECODING_MODE != "standard":
+        stats["speculative"] = dict(speculative.stats.snapshot(), mode=settings.DECODING_MODE)
+    return stats
+
+def require_executor():
+    if executor is None or not service_status.ready:
+        detail = "Model failed to load" if service_status.failed else f"Model not ready ({service_status.phase})"
+        raise HTTPException(status_code=503, detail=detail,
+                            headers={"Retry-After": str(settings.NOT_READY_RETRY_AFTER)})
+
+def select_adapter(name):
+    """Adapter for a request's ``model`` field; None when serving the single merged model."""
+    if adapters is None:
+        return None
     try:
-        # Format messages for the chat template
-        chat_messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
-        
-        # Tokenize input
-        inputs = tokenizer.apply_chat_template(
-            chat_messages,
-            return_tensors="pt"
-        ).to(model.device)
-        
-        # Generate response
-        with torch.no_grad():
-            outputs = model.generate(
-                inputs,
-                max_new_tokens=150,
-                temperature=0.7,
-                do_sample=True,
-                pad_token_id=tokenizer.eos_token_id
+        return adapters.resolve(name)
+    except UnknownAdapterError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+def adapter_job(adapter, fn):
+    """A standalone job function and prefix cache that run with ``adapter`` active."""
+    if adapter is None:
+        return fn, prefix_cache
+    return adapters.bind(adapter, fn), adapters.prefix_cache(adapter)
+
+def chat_job(adapter, chat_messages, params):
+    """Batch item and batch key for one chat; only chats for the same adapter share a batch."""
+    item = (chat_messages, params)
+    if adapter is None:
+        return item, ("chat", params.sampling_key())
+    return (adapter, item), ("chat", adapter, params.sampling_key())
+
+def fit_history(chat_messages, params):
+    """Trim the oldest turns so the prompt and the reply fit in the context window."""
+    try:
+        return context_window.fit(chat_messages, context_window.budget_for(params.max_new_tokens))
+    except PromptTooLongError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+def admission_error(e):
+    """Fast rejection: 429 for a full queue, 503 when the deadline can't be met."""
+    status = 429 if isinstance(e, QueueFullError) else 503
+    return HTTPException(status_code=status, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def await_job(awaitable, http_request, control):
+    """Wait for a job while watching its deadline and the client connection.
+
+    Leaving early cancels the awaited work, which cancels the job on the worker.
+    """
+    work = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            timeout = settings.DISCONNECT_POLL_SECONDS
+            remaining = control.remaining()
+            if remaining is not None:
+                timeout = min(timeout, remaining)
+            done, _ = await asyncio.wait({work}, timeout=timeout)
+            if done:
+                return work.result()
+            if control.expired():
+                raise DeadlineExceededError("Deadline exceeded")
+            if await http_request.is_disconnected():
+                raise ClientDisconnectedError()
+    finally:
+        if not work.done():
+            work.cancel()
+
+async def run_probe(chat_messages, max_new_tokens, timeout):
+    """Generate greedily through the high-priority lane; returns the latency in ms."""
+    started_at = time.perf_counter()
+    params = resolve_params(max_new_tokens=max_new_tokens, temperature=0)
+    item, batch_key = chat_job(select_adapter(None), chat_messages, params)
+    await executor.submit_batched(
+        chat_batch_fn,
+        item,
+        batch_key=batch_key,
+        control=JobControl(timeout),
+        tenant="probe",
+        lane="high",
+    )
+    return (time.perf_counter() - started_at) * 1000
+
+@app.get("/api/probe")
+async def generation_probe():
+    """Deep health check: generate one token through the high-priority lane."""
+    require_executor()
+    try:
+        latency_ms = await run_probe([{"role": "user", "content": "ping"}], 1, settings.PROBE_TIMEOUT)
+    except AdmissionError as e:
+        raise admission_error(e)
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    return {"status": "ok", "latency_ms": round(latency_ms, 1)}
+
+@app.post("/api/chat")
+async def chat_endpoint(request: ChatRequest, http_request: Request):
+    require_executor()
+
+    # Format messages for the chat template, dropping turns that don't fit
+    params = request.generation_params()
+    adapter = select_adapter(request.model)
+    history = fit_history([{"role": msg.role, "content": msg.content} for msg in request.messages], params)
+    chat_messages = history.messages
+
+    try:
+        control = request.job_control()
+
+        # Generation runs on a worker thread, batched with other pending chats
+        # that use the same adapter and sampling settings
+        item, batch_key = chat_job(adapter, chat_messages, params)
+
+        def generate(job_control):
+            return executor.submit_batched(
+                chat_batch_fn,
+                item,
+                batch_key=batch_key,
+                control=job_control,
+                tenant=request.tenant,
+                lane=lane(request.prompt_chars()),
             )
-        
-        # Decode and clean up the response
-        response = tokenizer.decode(outputs[0][inputs.shape[1]:], skip_special_tokens=True)
+
+        cache_params = dict(params.as_dict(), model=request.model)
+        if settings.RESPONSE_CACHE_SIZE > 0 and (request.cache or is_deterministic(cache_params)):
+            key = cache_key(chat_messages, cache_params)
+            # Identical requests share one generation but each keeps its own deadline
+            response = await await_job(response_cache.get_or_compute(key, generate, control), http_request, control)
+        else:
+            response = await await_job(generate(control), http_request, control)
         
         return {
             "response": response,
-            "model": request.model
+            "model": request.model,
+            "context": history.report(),
         }
         
+    except AdmissionError as e:
+        raise admission_error(e)
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientDisconnectedError:
+        print("Client disconnected, cancelled generation")
+        # Nobody is listening; 499 is nginx's 'client closed request'
+        return Response(status_code=499)
     except Exception as e:
         print(f"Error generating response: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/sessions")
+async def create_session(request: SessionCreateRequest):
+    select_adapter(request.model)
+    session = sessions.create(
+        [{"role": msg.role, "content": msg.content} for msg in request.messages],
+        model=request.model,
+    )
+    return session.describe()
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str):
+    try:
+        return sessions.get(session_id).describe()
+    except SessionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.delete("/api/sessions/{session_id}")
+async def delete_session(session_id: str):
+    try:
+        sessions.delete(session_id)
+    except SessionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "deleted", "session_id": session_id}
+
+@app.post("/api/sessions/{session_id}/chat")
+async def session_chat(session_id: str, request: SessionChatRequest, http_request: Request):
+    require_executor()
+
+    try:
+        session, chat_messages, cache, cached_ids = sessions.begin_turn(
+            session_id, {"role": "user", "content": request.content}
+        )
+    except SessionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except SessionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    params = request.generation_params()
+    try:
+        history = fit_history(chat_messages, params)
+        turn_fn, turn_prefix_cache = adapter_job(select_adapter(session.model), session_turn_fn)
+    except HTTPException:
+        sessions.abort_turn(session)
+        raise
+    # Dropped turns would be dropped again on every later turn, so forget them
+    chat_messages = history.messages
+    control = request.job_control()
+    try:
+        turn = await await_job(
+            executor.submit(
+                turn_fn, chat_messages, params, cache, cached_ids, control, turn_prefix_cache,
+                control=control, tenant=request.tenant, lane=lane(request.prompt_chars()),
+            ),
+            http_request,
+            control,
+        )
+    except AdmissionError as e:
+        sessions.abort_turn(session)
+        raise admission_error(e)
+    except DeadlineExceededError as e:
+        sessions.abort_turn(session)
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientDisconnectedError:
+        sessions.abort_turn(session)
+        print("Client disconnected, cancelled session turn")
+        return Response(status_code=499)
+    except Exception as e:
+        sessions.abort_turn(session)
+        print(f"Error generating session reply: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    chat_messages.append({"role": "assistant", "content": turn.reply})
+    sessions.finish_turn(session, chat_messages, turn.cache, turn.cached_ids, turn.reused_tokens)
+    return {
+        "session_id": session.id,
+        "response": turn.reply,
+        "prompt_tokens": turn.prompt_tokens,
+        "reused_tokens": turn.reused_tokens,
+        "context": history.report(),
+    }
+
+def sse_event(event, data):
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_timings(started_at, first_text_at, token_times):
+    """Time-to-first-token (first text sent) and mean inter-token latency in milliseconds."""
+    if not token_times or first_text_at is None:
+        return {"tokens": 0, "time_to_first_token_ms": None, "per_token_ms": None}
+    per_token = None
+    if len(token_times) > 1:
+        per_token = (token_times[-1] - token_times[0]) / (len(token_times) - 1) * 1000
+    return {
+        "tokens": len(token_times),
+        "time_to_first_token_ms": round((first_text_at - started_at) * 1000, 1),
+        "per_token_ms": round(per_token, 1) if per_token is not None else None,
+    }
+
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    require_executor()
+
+    started_at = time.perf_counter()
+    params = request.generation_params()
+    stream_fn, stream_prefix_cache = adapter_job(select_adapter(request.model), stream_reply)
+    history = fit_history([{"role": msg.role, "content": msg.content} for msg in request.messages], params)
+    chat_messages = history.messages
+    control = request.job_control()
+    tokens = asyncio.Queue()
+    streamer = TokenStreamer(tokenizer, asyncio.get_running_loop(), tokens, stop=params.stop)
+
+    try:
+        future = executor.submit(stream_fn, chat_messages, params, streamer, control, stream_prefix_cache,
+                                 control=control, tenant=request.tenant, lane=lane(request.prompt_chars()))
+    except AdmissionError as e:
+        raise admission_error(e)
+
+    async def event_stream():
+        first_token = True
+        try:
+            while True:
+                # Poll so a client that leaves while we are still queued is noticed
+                try:
+                    kind, text = await asyncio.wait_for(tokens.get(), timeout=settings.DISCONNECT_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    if await http_request.is_disconnected():
+                        print("Client disconnected, cancelling stream")
+                        return
+                    if control.expired():
+                        yield sse_event("error", {"detail": "Deadline exceeded"})
+                        return
+                    # The job was dropped before it started streaming
+                    if future.done():
+                        break
+                    continue
+                if kind == "end":
+                    break
+                if first_token:
+                    first_token = False
+                    metrics.TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started_at)
+                yield sse_event("token", {"text": text})
+
+            try:
+                response = await future
+            except Exception as e:
+                print(f"Error streaming response: {str(e)}")
+                yield sse_event("error", {"detail": str(e)})
+                return
+
+            done = {"response": response, "model": request.model, "context": history.report()}
+            done.update(stream_timings(started_at, streamer.first_text_at, streamer.token_times))
+            yield sse_event("done", done)
+        finally:
+            # Stop burning CPU on a reply nobody will read
+            control.cancel()
+            future.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def read_bulk_request(http_request):
+    """Parse a JSON ``{"items": [...]}`` body, or JSONL with one item per line.
+
+    For JSONL, ``model`` and ``tenant`` come from the query string.
+    """
+    body = await http_request.body()
+    if http_request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            return BulkChatRequest.model_validate_json(body)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+
+    items = []
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            items.append(BulkChatItem.model_validate_json(line))
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail={"line": line_number, "errors": e.errors(include_url=False)})
+    query = http_request.query_params
+    return BulkChatRequest(
+        items=items,
+        model=query.get("model", BulkChatRequest.model_fields["model"].default),
+        tenant=query.get("tenant"),
+    )
+
+@app.post("/api/chat/batch")
+async def bulk_chat_endpoint(http_request: Request):
+    """Run many conversations through batched generation and stream the results as JSONL.
+
+    Items are queued shortest prompt first (grouped by sampling settings) so
+    each batch pads as little as possible. Results stream back in completion
+    order with their input ``id``; a final ``summary`` line reports throughput.
+    """
+    require_executor()
+    request = await read_bulk_request(http_request)
+    if len(request.items) > settings.BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {settings.BULK_MAX_ITEMS} items per request")
+    adapter = select_adapter(request.model)
+    tenant = request.tenant or "bulk"
+
+    started_at = time.perf_counter()
+    jobs, rejected = [], []
+    for index, bulk_item in enumerate(request.items):
+        item_id = bulk_item.id if bulk_item.id is not None else index
+        params = bulk_item.generation_params()
+        try:
+            history = fit_history([{"role": msg.role, "content": msg.content} for msg in bulk_item.messages], params)
+        except HTTPException as e:
+            rejected.append({"id": item_id, "index": index, "status": e.status_code, "error": e.detail})
+            continue
+        item, batch_key = chat_job(adapter, history.messages, params)
+        jobs.append((params.sampling_key(), history.prompt_tokens, index, item_id, item, batch_key, history))
+    jobs.sort(key=lambda job: job[:3])
+    in_flight = settings.BULK_MAX_IN_FLIGHT or (
+        settings.TENANT_MAX_QUEUED + settings.BATCH_MAX_SIZE * settings.INFERENCE_WORKERS
+    )
+
+    async def run(job):
+        _, _, index, item_id, item, batch_key, history = job
+        try:
+            # Waits for queue room rather than being rejected, so bulk jobs
+            # don't show up in the overload stats
+            response = await executor.submit_batched_when_room(
+                chat_batch_fn, item, batch_key=batch_key, control=JobControl(), tenant=tenant, lane="normal"
+            )
+        except Exception as e:
+            return {"id": item_id, "index": index, "status": 500, "error": str(e)}
+        return {"id": item_id, "index": index, "response": response, "context": history.report()}
+
+    async def results():
+        succeeded = completion_tokens = 0
+        queued = collections.deque(jobs)
+        running = set()
+        try:
+            for result in rejected:
+                yield json.dumps(result) + "\n"
+            while queued or running:
+                while queued and len(running) < in_flight:
+                    running.add(asyncio.ensure_future(run(queued.popleft())))
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if "response" in result:
+                        succeeded += 1
+                        completion_tokens += len(tokenizer.encode(result["response"], add_special_tokens=False))
+                    yield json.dumps(result) + "\n"
+        finally:
+            # A client that leaves mid-job cancels the rest of it
+            for task in running:
+                task.cancel()
+
+        elapsed = time.perf_counter() - started_at
+        summary = {
+            "items": len(request.items),
+            "succeeded": succeeded,
+            "failed": len(request.items) - succeeded,
+            "elapsed_seconds": round(elapsed, 3),
+            "items_per_second": round(succeeded / elapsed, 3) if elapsed else 0.0,
+            "prompt_tokens": sum(job[1] for job in jobs),
+            "completion_tokens": completion_tokens,
+            "completion_tokens_per_second": round(completion_tokens / elapsed, 2) if elapsed else 0.0,
+        }
+        print(f"Bulk job: {succeeded}/{len(request.items)} items in {elapsed:.1f}s")
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,74 @@
+# api/merge_model.py
+"""Merge the LoRA adapter into the base model once and save a self-contained checkpoint.
+
+The API loads the result memory-mapped at startup instead of downloading the
+base model and merging the adapter on every start.
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import torch
+
+import settings
+from model_loader import (
+    MERGE_INFO_FILE,
+    adapter_fingerprint,
+    load_tokenizer,
+    merge_adapter,
+    peak_rss_mb,
+)
+
+
+# Checkpoint dtypes; a bf16 checkpoint lets INFERENCE_PRECISION=bf16 keep the mmap fast path
+DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16}
+
+
+def merge(adapter_path, base_model, output_dir, dtype="float32"):
+    if not os.path.exists(adapter_path):
+        raise FileNotFoundError(f"No PEFT adapter found at {adapter_path}")
+
+    start = time.perf_counter()
+    tokenizer = load_tokenizer(base_model)
+    model, _ = merge_adapter(base_model, adapter_path)
+    model = model.to(DTYPES[dtype])
+
+    print(f"Saving merged checkpoint to {output_dir}...")
+    os.makedirs(output_dir, exist_ok=True)
+    # One unsharded safetensors file keeps the startup path a single mmap
+    model.save_pretrained(output_dir, safe_serialization=True, max_shard_size="20GB")
+    tokenizer.save_pretrained(output_dir)
+
+    info = {
+        "base_model": base_model,
+        "adapter_path": os.path.abspath(adapter_path),
+        "adapter_fingerprint": adapter_fingerprint(adapter_path),
+        "dtype": str(next(model.parameters()).dtype).replace("torch.", ""),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(output_dir, MERGE_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+
+    print(f"Merged in {time.perf_counter() - start:.1f}s (peak RSS {peak_rss_mb():.0f} MB)")
+    print(f"Set MERGED_MODEL_PATH={output_dir} (the default) to serve it")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Merge the PEFT adapter into the base model')
+    parser.add_argument('--adapter', default=settings.MODEL_PATH,
+                        help=f'PEFT adapter directory (default: {settings.MODEL_PATH})')
+    parser.add_argument('--base-model', default=settings.BASE_MODEL,
+                        help=f'Base model (default: {settings.BASE_MODEL})')
+    parser.add_argument('--output', '-o', default=settings.MERGED_MODEL_PATH,
+                        help=f'Output directory (default: {settings.MERGED_MODEL_PATH})')
+    parser.add_argument('--dtype', choices=sorted(DTYPES), default='float32',
+                        help='Weight dtype of the saved checkpoint (default: float32)')
+
+    args = parser.parse_args()
+    merge(args.adapter, args.base_model, args.output, args.dtype)
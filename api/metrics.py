@@ -0,0 +1,172 @@
+# api/metrics.py
+"""Prometheus metrics for the API and the inference pipeline.
+
+When ``PROMETHEUS_MULTIPROC_DIR`` is set (serve.py sets it for multi-process
+serving) every worker writes its samples there and ``/metrics`` aggregates
+them across processes.
+"""
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (1, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 200, 400)
+
+REQUESTS = Counter(
+    "rohanai_requests_total",
+    "HTTP requests handled, by route and status code",
+    ["route", "method", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "rohanai_request_latency_seconds",
+    "Time to produce the HTTP response, by route",
+    ["route", "method"],
+    buckets=LATENCY_BUCKETS,
+)
+# Per-tenant wait and depth are reported by /api/stats instead; tenant IDs would
+# make the label cardinality unbounded
+QUEUE_WAIT = Histogram(
+    "rohanai_queue_wait_seconds",
+    "Time a job spent in the inference queue before a worker picked it up, by priority lane",
+    ["lane"],
+    buckets=LATENCY_BUCKETS,
+)
+QUEUE_DEPTH = Gauge(
+    "rohanai_queue_depth",
+    "Jobs waiting in the inference queue, by priority lane",
+    ["lane"],
+    multiprocess_mode="livesum",
+)
+BATCH_SIZE = Histogram(
+    "rohanai_batch_size",
+    "Number of requests sharing one generate call",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32),
+)
+STAGE_SECONDS = Histogram(
+    "rohanai_stage_seconds",
+    "Time spent per inference stage (chat_template, prefill, decode, detokenize)",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+PROMPT_TOKENS = Histogram(
+    "rohanai_prompt_tokens",
+    "Prompt length in tokens per request",
+    buckets=TOKEN_BUCKETS,
+)
+COMPLETION_TOKENS = Histogram(
+    "rohanai_completion_tokens",
+    "Generated tokens per request",
+    buckets=TOKEN_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "rohanai_tokens_per_second",
+    "Generated tokens per second of generate() time, per call",
+    buckets=RATE_BUCKETS,
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "rohanai_time_to_first_token_seconds",
+    "Time from request arrival to the first streamed token",
+    buckets=LATENCY_BUCKETS,
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "rohanai_model_load_seconds",
+    "Duration of the last model load",
+    multiprocess_mode="max",
+)
+RESPONSE_CACHE_EVENTS = Counter(
+    "rohanai_response_cache_events_total",
+    "Response cache lookups by outcome (hit, miss, coalesced)",
+    ["outcome"],
+)
+PREFIX_CACHE_EVENTS = Counter(
+    "rohanai_prefix_cache_events_total",
+    "Prefix KV-cache lookups by outcome (hit, miss)",
+    ["outcome"],
+)
+HISTORY_DROPPED_TOKENS = Histogram(
+    "rohanai_history_dropped_tokens",
+    "Tokens of old chat history dropped per request to fit the context window",
+    buckets=(0,) + TOKEN_BUCKETS,
+)
+SPECULATIVE_TOKENS = Counter(
+    "rohanai_speculative_tokens_total",
+    "Speculative decoding draft tokens, by outcome (drafted, accepted)",
+    ["outcome"],
+)
+ADAPTER_EVENTS = Counter(
+    "rohanai_adapter_events_total",
+    "LoRA adapter cache activity by outcome (hit, load, evicted)",
+    ["outcome"],
+)
+SESSION_EVENTS = Counter(
+    "rohanai_session_events_total",
+    "Session turns by KV-cache outcome (hit, miss) and session evictions by reason",
+    ["outcome"],
+)
+SESSION_CACHE_BYTES = Gauge(
+    "rohanai_session_cache_bytes",
+    "Bytes of KV cache retained by chat sessions",
+    multiprocess_mode="livesum",
+)
+
+
+class StageTimer:
+    """Context manager that records its duration under one inference stage."""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        STAGE_SECONDS.labels(self.stage).observe(self.seconds)
+        return False
+
+
+def observe_generation(started_at, first_token_at, finished_at, prompt_tokens, completion_tokens):
+    """Record prefill/decode split, token counts and throughput for one generate call.
+
+    ``first_token_at`` is when the first new token existed, which closes the
+    prefill stage; everything after it is decode.
+    """
+    if first_token_at is None:
+        first_token_at = finished_at
+    STAGE_SECONDS.labels("prefill").observe(first_token_at - started_at)
+    STAGE_SECONDS.labels("decode").observe(finished_at - first_token_at)
+    for count in prompt_tokens:
+        PROMPT_TOKENS.observe(count)
+    for count in completion_tokens:
+        COMPLETION_TOKENS.observe(count)
+    elapsed = finished_at - started_at
+    if elapsed > 0:
+        TOKENS_PER_SECOND.observe(sum(completion_tokens) / elapsed)
+
+
+def render():
+    """Return ``(body, content_type)`` for the /metrics endpoint."""
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drop a dead worker's live gauges in multi-process mode."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
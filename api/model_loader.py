@@ -0,0 +1,228 @@
+# api/model_loader.py
+"""Model and tokenizer loading for the API, including the pre-merged fast path."""
+import hashlib
+import json
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from peft import PeftModel
+
+# Written next to a pre-merged checkpoint by merge_model.py
+MERGE_INFO_FILE = "merge_info.json"
+
+# Files that define a PEFT adapter; any change to them invalidates a merged checkpoint
+ADAPTER_FILES = ("adapter_config.json", "adapter_model.safetensors", "adapter_model.bin")
+
+# Supported INFERENCE_PRECISION values
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def adapter_fingerprint(adapter_path):
+    """Content hash of the adapter files, or None if there is no adapter."""
+    adapter_path = Path(adapter_path)
+    digest = hashlib.sha256()
+    found = False
+    for name in ADAPTER_FILES:
+        file_path = adapter_path / name
+        if not file_path.exists():
+            continue
+        found = True
+        digest.update(name.encode("utf-8"))
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest() if found else None
+
+
+def read_merge_info(merged_path):
+    info_path = Path(merged_path) / MERGE_INFO_FILE
+    if not info_path.exists():
+        return None
+    with open(info_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_tokenizer(source):
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # Batched generation needs prompts padded on the left
+    tokenizer.padding_side = "left"
+    return tokenizer
+
+
+def merge_adapter(base_model, adapter_path):
+    """Load the float32 base model and merge the PEFT adapter into it, if present."""
+    print("Loading base model...")
+    model = AutoModelForCausalLM.from_pretrained(
+        base_model,
+        torch_dtype=torch.float32,  # Use float32 for better compatibility
+        device_map="cpu",  # Use CPU for stable deployment
+        trust_remote_code=True
+    )
+
+    # Try to load fine-tuned weights if available
+    if os.path.exists(adapter_path):
+        print("Loading fine-tuned PEFT adapter...")
+        model = PeftModel.from_pretrained(model, adapter_path)
+        model = model.merge_and_unload()
+        print("Fine-tuned model loaded successfully!")
+        return model, "adapter"
+
+    print(f"Fine-tuned model not found at {adapter_path}, using base model")
+    return model, "base"
+
+
+def usable_merged_artifact(merged_path, adapter_path):
+    """True if merged_path holds a checkpoint built from the current adapter."""
+    info = read_merge_info(merged_path)
+    if info is None:
+        return False
+    current = adapter_fingerprint(adapter_path) if os.path.exists(adapter_path) else None
+    if current is not None and info.get("adapter_fingerprint") != current:
+        print(f"Pre-merged model at {merged_path} was built from a different adapter, ignoring it")
+        return False
+    return True
+
+
+def apply_precision(model, precision):
+    """Convert an already-merged model to the requested CPU inference precision.
+
+    ``fp32`` keeps full precision, ``bf16`` halves the weight bytes streamed per
+    decoded token, and ``int8`` swaps every nn.Linear for a dynamically
+    quantized one (int8 weights, activations quantized on the fly).
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {', '.join(PRECISIONS)}")
+
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+
+    model = model.to(torch.float32)
+    if precision == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def current_rss_mb():
+    """Current resident set size of this process in MB (Linux only, else peak)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def load_model_and_tokenizer(adapter_path, base_model, merged_path, precision="fp32"):
+    """Load the serving model, preferring a pre-merged checkpoint.
+
+    The precision mode is applied after the adapter has been merged. Returns
+    ``(model, tokenizer, info)`` where ``info`` records the load path,
+    precision, duration and memory use.
+    """
+    start = time.perf_counter()
+
+    if merged_path and usable_merged_artifact(merged_path, adapter_path):
+        print(f"Loading pre-merged model from {merged_path}...")
+        tokenizer = load_tokenizer(merged_path)
+        # Keep the stored dtype so safetensors can map the weights straight from
+        # the page cache instead of converting them into fresh allocations
+        model = AutoModelForCausalLM.from_pretrained(
+            merged_path,
+            torch_dtype="auto",
+            device_map="cpu",
+            low_cpu_mem_usage=True,
+            use_safetensors=True,
+        )
+        source = "merged"
+    else:
+        print("Loading tokenizer...")
+        tokenizer = load_tokenizer(base_model)
+        model, source = merge_adapter(base_model, adapter_path)
+
+    model = apply_precision(model, precision)
+    model.eval()
+    info = {
+        "source": source,
+        "precision": precision,
+        "load_seconds": round(time.perf_counter() - start, 2),
+        "rss_mb": round(current_rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(f"Model loaded from {source} as {precision} in {info['load_seconds']}s "
+          f"(RSS {info['rss_mb']} MB, peak {info['peak_rss_mb']} MB)")
+    return model, tokenizer, info
+
+
+def serving_adapters(adapters_dir, default_path, default_name):
+    """Adapters to serve: every PEFT adapter under adapters_dir plus the default one."""
+    from adapters import find_adapters
+
+    found = find_adapters(adapters_dir)
+    if os.path.exists(default_path):
+        found[default_name] = default_path
+    return found
+
+
+def load_adapter_model(base_model, adapters, default_name, precision="fp32"):
+    """Load the base weights once and wrap them in a PeftModel for hot-swapped adapters.
+
+    ``adapters`` maps adapter name to path; the ``default_name`` adapter (or
+    the first one) is loaded now and the rest on demand by AdapterRegistry.
+    Returns ``(model, tokenizer, info)`` like ``load_model_and_tokenizer``.
+    """
+    if precision == "int8":
+        raise ValueError("int8 layers can't host LoRA adapters; use fp32 or bf16 with ADAPTERS_DIR")
+    if not adapters:
+        raise FileNotFoundError("No PEFT adapters found to serve")
+
+    start = time.perf_counter()
+    print("Loading tokenizer...")
+    tokenizer = load_tokenizer(base_model)
+    print("Loading base model for adapter serving...")
+    model = AutoModelForCausalLM.from_pretrained(
+        base_model,
+        torch_dtype=torch.float32,
+        device_map="cpu",
+        low_cpu_mem_usage=True,
+    )
+    model = apply_precision(model, precision)
+
+    first = default_name if default_name in adapters else next(iter(adapters))
+    print(f"Loading adapter {first}...")
+    model = PeftModel.from_pretrained(model, adapters[first], adapter_name=first)
+    model.eval()
+    info = {
+        "source": "adapters",
+        "precision": precision,
+        "load_seconds": round(time.perf_counter() - start, 2),
+        "rss_mb": round(current_rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(f"Base model with adapter {first} loaded as {precision} in {info['load_seconds']}s "
+          f"(RSS {info['rss_mb']} MB, peak {info['peak_rss_mb']} MB)")
+    return model, tokenizer, info
+
+
+def load_draft_model(name, precision="fp32"):
+    """Load the small drafting model for speculative decoding, in the serving precision."""
+    print(f"Loading draft model {name}...")
+    model = AutoModelForCausalLM.from_pretrained(name, device_map="cpu", low_cpu_mem_usage=True)
+    model = apply_precision(model, precision)
+    model.eval()
+    return model
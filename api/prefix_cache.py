@@ -0,0 +1,105 @@
+# api/prefix_cache.py
+"""Reusable past-key-values for chat-template prefixes shared between requests."""
+import collections
+import copy
+import threading
+
+import metrics
+
+
+def leading_system_messages(messages):
+    """Return the run of system messages at the start of a conversation."""
+    count = 0
+    while count < len(messages) and messages[count]["role"] == "system":
+        count += 1
+    return messages[:count]
+
+
+def common_prefix_length(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class PrefixCache:
+    """Small LRU of prefilled KV caches keyed by prefix token ids.
+
+    The prefix of a conversation is its leading system messages rendered with
+    the chat template (e.g. the bot's "You are a helpful assistant." prompt).
+    The first request with a given prefix prefills it once; later requests
+    start generation from a copy of that state, so only their own turns need
+    a prefill.
+    """
+
+    def __init__(self, max_entries=8, min_tokens=8):
+        self.max_entries = max_entries
+        self.min_tokens = min_tokens
+        self._caches = collections.OrderedDict()
+        self._prefix_ids = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def lookup(self, engine, tokenizer, messages, prompt_ids):
+        """Return a private copy of the cached KV state for this prompt's prefix, or None."""
+        prefix = self._prefix_for(tokenizer, messages, prompt_ids)
+        if prefix is None:
+            return None
+
+        with self._lock:
+            cache = self._caches.get(prefix)
+            if cache is not None:
+                self._caches.move_to_end(prefix)
+                self.hits += 1
+                self.reused_tokens += len(prefix)
+        metrics.PREFIX_CACHE_EVENTS.labels("hit" if cache is not None else "miss").inc()
+        if cache is None:
+            cache = self._prefill(engine, prefix)
+            with self._lock:
+                self.misses += 1
+                self._caches[prefix] = cache
+                while len(self._caches) > self.max_entries:
+                    self._caches.popitem(last=False)
+
+        # generate() extends the cache in place, so every caller gets its own copy
+        return copy.deepcopy(cache)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._caches),
+                "hits": self.hits,
+                "misses": self.misses,
+                "reused_prefill_tokens": self.reused_tokens,
+            }
+
+    def _prefix_for(self, tokenizer, messages, prompt_ids):
+        system = leading_system_messages(messages)
+        if not system or len(system) == len(messages):
+            return None
+
+        key = tuple((m["role"], m["content"]) for m in system)
+        with self._lock:
+            prefix_ids = self._prefix_ids.get(key)
+        if prefix_ids is None:
+            prefix_ids = tuple(tokenizer.apply_chat_template(system))
+            with self._lock:
+                self._prefix_ids[key] = prefix_ids
+                if len(self._prefix_ids) > self.max_entries * 4:
+                    self._prefix_ids.pop(next(iter(self._prefix_ids)))
+
+        # Only reuse the part that tokenizes identically inside the full prompt,
+        # and always leave at least one new token for generate() to prefill
+        length = common_prefix_length(prefix_ids, prompt_ids)
+        length = min(length, len(prompt_ids) - 1)
+        if length < self.min_tokens:
+            return None
+        return tuple(prompt_ids[:length])
+
+    def _prefill(self, engine, prefix):
+        _, state = engine.prefill(prefix)
+        return state.past_key_values
@@ -0,0 +1,156 @@
+# api/response_cache.py
+"""Response cache with single-flight coalescing for identical chat requests."""
+import asyncio
+import collections
+import hashlib
+import json
+import time
+
+import metrics
+from inference import JobControl
+
+# Rough per-entry bookkeeping cost on top of the key and response text
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def normalize_messages(messages):
+    """Canonical form of a message list: lower-case roles, trimmed, whitespace-collapsed content."""
+    return [
+        {"role": m["role"].strip().lower(), "content": " ".join(m["content"].split())}
+        for m in messages
+    ]
+
+
+def cache_key(messages, params):
+    """Stable hash of the normalized messages plus the generation parameters."""
+    payload = json.dumps(
+        {"messages": normalize_messages(messages), "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(params):
+    """Greedy decoding always produces the same reply, so it is safe to cache."""
+    return not params.get("do_sample", True)
+
+
+class ResponseCache:
+    """LRU + TTL cache of generated replies, bounded by entry count and bytes.
+
+    ``get_or_compute`` also coalesces concurrent misses for the same key: the
+    first caller starts the generation and later callers await the same task
+    instead of queueing their own. Lives on the event loop, so no locking.
+
+    The shared generation runs under its own JobControl whose deadline is the
+    latest of its waiters', so one waiter's deadline never fails the others;
+    each waiter still enforces its own deadline while it waits.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=4 * 1024 * 1024, ttl=3600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._inflight = {}
+        self._controls = {}
+        self._waiters = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, size, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        size = len(key) + len(value.encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, size, time.monotonic() + self.ttl)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    async def get_or_compute(self, key, compute, control=None):
+        """Return a cached reply, join an identical in-flight generation, or start one.
+
+        ``compute`` takes the shared generation's JobControl and returns an
+        awaitable reply; ``control`` is the caller's own (None: no deadline).
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            metrics.RESPONSE_CACHE_EVENTS.labels("hit").inc()
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            metrics.RESPONSE_CACHE_EVENTS.labels("coalesced").inc()
+            self._controls[key].extend(control or JobControl())
+        else:
+            self.misses += 1
+            metrics.RESPONSE_CACHE_EVENTS.labels("miss").inc()
+            shared = JobControl()
+            shared.deadline = control.deadline if control is not None else None
+            task = asyncio.ensure_future(compute(shared))
+            self._inflight[key] = task
+            self._controls[key] = shared
+            task.add_done_callback(lambda t: self._finish(key, t))
+
+        # Shield the shared task so one caller giving up doesn't cancel it for the
+        # rest; only when the last waiter leaves is the generation itself cancelled
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "inflight": len(self._inflight),
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+        }
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        self._controls.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self.put(key, task.result())
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
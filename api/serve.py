@@ -0,0 +1,181 @@
+# api/serve.py
+"""Multi-process API server that shares one copy of the model weights between workers.
+
+In ``fork`` mode with more than one worker the parent loads (or memory-maps)
+the model once and forks N uvicorn workers; the weight tensors are never
+written after loading, so their pages stay shared copy-on-write. A single
+worker loads the model itself in the background. In ``spawn`` mode each
+worker maps the pre-merged safetensors checkpoint itself and the OS page cache
+holds the only copy. Either way every worker is pinned to its own slice of cores with a
+matching torch thread count.
+"""
+import gc
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import settings
+
+
+def available_core_ids():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(processes):
+    """Split the available cores into contiguous, near-equal slices, one per worker."""
+    cores = available_core_ids()
+    if processes >= len(cores):
+        # More workers than cores: give each worker one core, wrapping around
+        return [[cores[i % len(cores)]] for i in range(processes)]
+    size, extra = divmod(len(cores), processes)
+    slices = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def pin_to_cores(cores):
+    import torch
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    # The inference worker threads inside this process share the pinned cores
+    settings.TORCH_THREADS_PER_WORKER = max(1, len(cores) // max(1, settings.INFERENCE_WORKERS))
+
+
+def run_worker(index, cores, sock, log_level, preloaded=None, preload_error=None):
+    """Entry point of one serving process."""
+    import uvicorn
+
+    pin_to_cores(cores)
+    import main
+
+    if preloaded is not None:
+        main.use_preloaded_model(*preloaded)
+    elif preload_error is not None:
+        # Serve anyway so health checks and /api/status report the failure
+        main.use_failed_preload(preload_error)
+
+    print(f"Worker {index} (pid {os.getpid()}) serving on cores {cores}")
+    config = uvicorn.Config(main.app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def load_shared_model():
+    """Load the model in the parent so forked workers inherit it copy-on-write."""
+    if settings.INFERENCE_ENGINE != "torch":
+        # ONNX Runtime's thread pools don't survive a fork; each worker loads its own session
+        print(f"The {settings.INFERENCE_ENGINE} engine is loaded by each worker, not shared")
+        return None
+
+    from engines import from_settings
+
+    loaded = from_settings().load()
+    # Move everything allocated so far out of the collector's reach, so GC passes
+    # in the workers don't write to (and un-share) the parent's object pages
+    gc.collect()
+    gc.freeze()
+    return loaded
+
+
+def serve(host, port, processes, start_method, log_level):
+    # Workers write Prometheus samples to a shared directory so /metrics on any
+    # of them reports the whole server; must be set before prometheus_client loads
+    if processes > 1 and not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="rohanai-metrics-")
+    import metrics
+
+    core_slices = partition_cores(processes)
+    sock = bind_socket(host, port)
+    print(f"Listening on {host}:{port} with {processes} {start_method}ed worker process(es)")
+
+    preloaded = None
+    preload_error = None
+    if start_method == "spawn":
+        if not os.path.exists(os.path.join(settings.MERGED_MODEL_PATH, "merge_info.json")):
+            print(f"Warning: no pre-merged checkpoint at {settings.MERGED_MODEL_PATH}; "
+                  f"spawned workers will each hold a private copy of the model")
+    elif processes > 1:
+        # Nothing listens until this returns; a single worker has nothing to share,
+        # so it skips this and loads in the background like `uvicorn main:app`
+        try:
+            preloaded = load_shared_model()
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            preload_error = str(e)
+
+    context = multiprocessing.get_context(start_method)
+
+    def start(index):
+        process = context.Process(
+            target=run_worker,
+            args=(index, core_slices[index], sock, log_level, preloaded, preload_error),
+            name=f"api-worker-{index}",
+        )
+        process.start()
+        return process
+
+    workers = {index: start(index) for index in range(processes)}
+
+    stopping = False
+
+    def handle_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    # Supervise: restart workers that die, forward shutdown to all of them
+    while not stopping:
+        time.sleep(1)
+        for index, process in list(workers.items()):
+            if not process.is_alive() and not stopping:
+                print(f"Worker {index} exited with code {process.exitcode}, restarting")
+                metrics.mark_process_dead(process.pid)
+                workers[index] = start(index)
+
+    print("Shutting down workers...")
+    for process in workers.values():
+        if process.is_alive():
+            process.terminate()
+    for process in workers.values():
+        process.join(timeout=30)
+    sock.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve the API from several processes sharing one model')
+    parser.add_argument('--host', default=os.getenv("API_HOST", "0.0.0.0"))
+    parser.add_argument('--port', type=int, default=settings.env_int("API_PORT", 8000))
+    parser.add_argument('--processes', '-p', type=int, default=settings.SERVE_PROCESSES,
+                        help=f'Worker processes (default: {settings.SERVE_PROCESSES})')
+    parser.add_argument('--start-method', choices=['fork', 'spawn'], default=settings.SERVE_START_METHOD,
+                        help='fork shares the parent-loaded model; spawn maps the merged checkpoint per worker')
+    parser.add_argument('--log-level', default='info')
+
+    args = parser.parse_args()
+    serve(args.host, args.port, max(1, args.processes), args.start_method, args.log_level)
@@ -0,0 +1,200 @@
+# api/sessions.py
+"""Server-side chat sessions that keep their history and the KV cache of their last turn."""
+import collections
+import secrets
+import time
+
+import metrics
+
+
+class SessionNotFoundError(Exception):
+    """Raised for an unknown or expired session ID."""
+
+
+class SessionBusyError(Exception):
+    """Raised when a session already has a turn in progress."""
+
+
+def cache_nbytes(cache):
+    """Bytes held by the key/value tensors of a DynamicCache."""
+    if cache is None:
+        return 0
+    if hasattr(cache, "layers"):
+        tensors = [getattr(layer, name, None) for layer in cache.layers for name in ("keys", "values")]
+    else:
+        tensors = list(cache.key_cache) + list(cache.value_cache)
+    return sum(t.numel() * t.element_size() for t in tensors if t is not None and hasattr(t, "numel"))
+
+
+class Session:
+    """One conversation: its messages plus the KV state covering ``cached_ids``."""
+
+    __slots__ = ("id", "model", "messages", "cache", "cached_ids", "cache_bytes", "busy", "turns",
+                 "created_at", "last_used")
+
+    def __init__(self, session_id, messages, model=None):
+        self.id = session_id
+        self.model = model
+        self.messages = list(messages)
+        self.cache = None
+        self.cached_ids = ()
+        self.cache_bytes = 0
+        self.busy = False
+        self.turns = 0
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+
+    def describe(self):
+        return {
+            "session_id": self.id,
+            "model": self.model,
+            "messages": list(self.messages),
+            "turns": self.turns,
+            "cached_tokens": len(self.cached_ids),
+            "cache_bytes": self.cache_bytes,
+            "busy": self.busy,
+        }
+
+
+class SessionStore:
+    """LRU of sessions bounded by a KV-cache memory budget, an idle TTL and a count.
+
+    When the retained KV caches exceed ``max_bytes`` the least recently used
+    sessions lose their cache (their history stays, so the next turn just
+    prefills it again). Sessions idle for ``ttl`` seconds are removed, as are
+    the least recently used ones beyond ``max_sessions``. A session's cache is
+    checked out for the duration of a turn, so eviction never touches a cache
+    that a worker is extending. Lives on the event loop, so no locking.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=1800.0, max_sessions=1000):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.evictions = collections.Counter()
+
+    def create(self, messages=(), model=None):
+        self._expire()
+        session = Session(secrets.token_urlsafe(16), messages, model)
+        self._sessions[session.id] = session
+        while len(self._sessions) > self.max_sessions:
+            if not self._evict_oldest_idle():
+                break
+        return session
+
+    def get(self, session_id):
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise SessionNotFoundError(f"Unknown session {session_id}")
+        self._touch(session)
+        return session
+
+    def delete(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise SessionNotFoundError(f"Unknown session {session_id}")
+        self._remove(session)
+
+    def begin_turn(self, session_id, message):
+        """Check out a session for one turn.
+
+        Returns ``(session, messages, cache, cached_ids)`` where ``messages`` is
+        the history plus ``message``; the session is left unchanged until
+        ``finish_turn``.
+        """
+        session = self.get(session_id)
+        if session.busy:
+            raise SessionBusyError("Session already has a turn in progress")
+        session.busy = True
+        cache, cached_ids = session.cache, session.cached_ids
+        self._set_cache(session, None, ())
+        return session, session.messages + [message], cache, cached_ids
+
+    def finish_turn(self, session, messages, cache, cached_ids, reused_tokens):
+        """Store the completed turn's history and the cache it left behind."""
+        session.busy = False
+        session.turns += 1
+        session.messages = list(messages)
+        if reused_tokens:
+            self.hits += 1
+            self.reused_tokens += reused_tokens
+        else:
+            self.misses += 1
+        metrics.SESSION_EVENTS.labels("hit" if reused_tokens else "miss").inc()
+        if session.id not in self._sessions:
+            # Deleted while the turn was running
+            return
+        self._set_cache(session, cache, tuple(cached_ids))
+        self._touch(session)
+        self._enforce_budget()
+
+    def abort_turn(self, session):
+        """Release a session after a failed or cancelled turn; its history is unchanged."""
+        session.busy = False
+
+    def stats(self):
+        self._expire()
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._sessions),
+            "cached_sessions": sum(1 for s in self._sessions.values() if s.cache is not None),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "reused_prefill_tokens": self.reused_tokens,
+            "evictions": dict(self.evictions),
+        }
+
+    def _touch(self, session):
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(session.id)
+
+    def _set_cache(self, session, cache, cached_ids):
+        self.bytes -= session.cache_bytes
+        session.cache = cache
+        session.cached_ids = cached_ids if cache is not None else ()
+        session.cache_bytes = cache_nbytes(cache)
+        self.bytes += session.cache_bytes
+        metrics.SESSION_CACHE_BYTES.set(self.bytes)
+
+    def _remove(self, session):
+        self._set_cache(session, None, ())
+        del self._sessions[session.id]
+
+    def _evict(self, reason):
+        self.evictions[reason] += 1
+        metrics.SESSION_EVENTS.labels(f"evicted_{reason}").inc()
+
+    def _expire(self):
+        now = time.monotonic()
+        for session in list(self._sessions.values()):
+            if now - session.last_used < self.ttl:
+                # Ordered by last use, so the rest are fresher
+                break
+            if not session.busy:
+                self._remove(session)
+                self._evict("ttl")
+
+    def _evict_oldest_idle(self):
+        for session in self._sessions.values():
+            if not session.busy:
+                self._remove(session)
+                self._evict("capacity")
+                return True
+        return False
+
+    def _enforce_budget(self):
+        for session in list(self._sessions.values()):
+            if self.bytes <= self.max_bytes:
+                return
+            if session.cache is not None:
+                self._set_cache(session, None, ())
+                self._evict("memory")
@@ -0,0 +1,144 @@
+# api/settings.py
+"""Environment-driven configuration for the RohanAI API."""
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+
+def env_int(name, default):
+    """Read an integer environment variable, falling back to default."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+def env_float(name, default):
+    """Read a float environment variable, falling back to default."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return float(value)
+
+
+def env_bool(name, default):
+    """Read a boolean environment variable (1/true/yes/on)."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_weights(name):
+    """Read a ``key=weight,key=weight`` environment variable into a dict."""
+    weights = {}
+    for pair in os.getenv(name, "").split(","):
+        if "=" in pair:
+            key, weight = pair.rsplit("=", 1)
+            weights[key.strip()] = max(1, int(weight))
+    return weights
+
+
+# Model
+MODEL_PATH = os.getenv("MODEL_PATH", "./models/tinyllama-finetuned")
+BASE_MODEL = os.getenv("BASE_MODEL", "TinyLlama/TinyLlama-1.1B-Chat-v1.0")
+# Self-contained checkpoint written by merge_model.py; used instead of merging at startup
+MERGED_MODEL_PATH = os.getenv("MERGED_MODEL_PATH", "./models/tinyllama-merged")
+# CPU inference precision applied after the adapter merge: fp32, bf16 or int8
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "fp32").strip().lower()
+# Inference engine: torch (eager PyTorch) or onnx (ONNX Runtime CPU, exported from
+# the merged checkpoint into ONNX_MODEL_PATH on first start)
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "torch").strip().lower()
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", "./models/tinyllama-onnx")
+# ONNX Runtime intra-op threads; 0 lets ONNX Runtime use every core
+ONNX_THREADS = env_int("ONNX_THREADS", 0)
+
+# Multi-process serving (serve.py): processes share one copy of the weights
+SERVE_PROCESSES = env_int("SERVE_PROCESSES", 1)
+SERVE_START_METHOD = os.getenv("SERVE_START_METHOD", "fork")
+
+# Inference workers
+INFERENCE_WORKERS = env_int("INFERENCE_WORKERS", 1)
+INFERENCE_QUEUE_SIZE = env_int("INFERENCE_QUEUE_SIZE", 32)
+# 0 means split the available cores evenly between the workers
+TORCH_THREADS_PER_WORKER = env_int("TORCH_THREADS_PER_WORKER", 0)
+
+# Dynamic batching: gather up to BATCH_MAX_SIZE chats arriving within BATCH_MAX_WAIT_MS
+BATCH_MAX_SIZE = env_int("BATCH_MAX_SIZE", 8)
+BATCH_MAX_WAIT_MS = env_float("BATCH_MAX_WAIT_MS", 50)
+
+# KV-cache reuse for shared system-prompt prefixes (0 disables)
+PREFIX_CACHE_SIZE = env_int("PREFIX_CACHE_SIZE", 8)
+PREFIX_CACHE_MIN_TOKENS = env_int("PREFIX_CACHE_MIN_TOKENS", 8)
+
+# Response cache for identical chat requests (0 entries disables)
+RESPONSE_CACHE_SIZE = env_int("RESPONSE_CACHE_SIZE", 256)
+RESPONSE_CACHE_MAX_BYTES = env_int("RESPONSE_CACHE_MAX_BYTES", 4 * 1024 * 1024)
+RESPONSE_CACHE_TTL = env_float("RESPONSE_CACHE_TTL", 3600)
+
+# Per-request generation controls: defaults and the server-side caps they are clamped to
+DEFAULT_MAX_NEW_TOKENS = env_int("DEFAULT_MAX_NEW_TOKENS", 150)
+MAX_NEW_TOKENS_LIMIT = env_int("MAX_NEW_TOKENS_LIMIT", 256)
+DEFAULT_TEMPERATURE = env_float("DEFAULT_TEMPERATURE", 0.7)
+MAX_TEMPERATURE = env_float("MAX_TEMPERATURE", 1.5)
+MAX_STOP_SEQUENCES = env_int("MAX_STOP_SEQUENCES", 4)
+MAX_STOP_LENGTH = env_int("MAX_STOP_LENGTH", 32)
+
+# Deadlines and backpressure: default and maximum per-request deadline (kept under
+# nginx's 60s proxy_read_timeout), and how often waiting requests check the client
+REQUEST_TIMEOUT = env_float("REQUEST_TIMEOUT", 55)
+MAX_REQUEST_TIMEOUT = env_float("MAX_REQUEST_TIMEOUT", 55)
+DISCONNECT_POLL_SECONDS = env_float("DISCONNECT_POLL_SECONDS", 0.5)
+NOT_READY_RETRY_AFTER = env_int("NOT_READY_RETRY_AFTER", 10)
+
+# Fair-share scheduling between tenants (Discord channels): queued jobs allowed per
+# tenant (0 = no limit), optional "tenant=weight,..." turn weights, prompts of up to
+# PRIORITY_PROMPT_CHARS characters go to the high-priority lane, which may take
+# HIGH_PRIORITY_BURST turns in a row while normal jobs wait
+TENANT_MAX_QUEUED = env_int("TENANT_MAX_QUEUED", 8)
+TENANT_WEIGHTS = env_weights("TENANT_WEIGHTS")
+PRIORITY_PROMPT_CHARS = env_int("PRIORITY_PROMPT_CHARS", 256)
+HIGH_PRIORITY_BURST = env_int("HIGH_PRIORITY_BURST", 4)
+PROBE_TIMEOUT = env_float("PROBE_TIMEOUT", 10)
+
+# Chat sessions: KV-cache memory budget (MB) across all sessions, idle TTL, and
+# the most sessions kept at once
+SESSION_CACHE_MB = env_int("SESSION_CACHE_MB", 256)
+SESSION_TTL = env_float("SESSION_TTL", 1800)
+SESSION_MAX_COUNT = env_int("SESSION_MAX_COUNT", 1000)
+
+# Context window: histories are trimmed (oldest turns first) so the prompt plus
+# max_new_tokens fits in MODEL_CONTEXT_TOKENS; PROMPT_TOKEN_BUDGET caps the prompt
+# further (0 = no extra cap)
+MODEL_CONTEXT_TOKENS = env_int("MODEL_CONTEXT_TOKENS", 2048)
+PROMPT_TOKEN_BUDGET = env_int("PROMPT_TOKEN_BUDGET", 0)
+
+# Decoding of greedy single-request batches: standard, prompt_lookup (n-gram drafts
+# from the prompt) or draft_model (SPECULATIVE_DRAFT_MODEL, which must share the
+# tokenizer). SPECULATIVE_NUM_TOKENS draft tokens are verified per forward pass
+DECODING_MODE = os.getenv("DECODING_MODE", "standard").strip().lower()
+SPECULATIVE_NUM_TOKENS = env_int("SPECULATIVE_NUM_TOKENS", 5)
+SPECULATIVE_MAX_NGRAM = env_int("SPECULATIVE_MAX_NGRAM", 3)
+SPECULATIVE_DRAFT_MODEL = os.getenv("SPECULATIVE_DRAFT_MODEL", "")
+
+# Multi-adapter serving: every PEFT adapter directory under ADAPTERS_DIR is served
+# on top of one copy of BASE_MODEL, selected by the request's "model" field. The
+# MODEL_PATH adapter is served as DEFAULT_ADAPTER_NAME. Unset to serve the single
+# merged model instead
+ADAPTERS_DIR = os.getenv("ADAPTERS_DIR", "")
+DEFAULT_ADAPTER_NAME = os.getenv("DEFAULT_ADAPTER_NAME", "tinyllama-finetuned")
+MAX_LOADED_ADAPTERS = env_int("MAX_LOADED_ADAPTERS", 4)
+ADAPTER_CACHE_MB = env_int("ADAPTER_CACHE_MB", 256)
+
+# Startup: run a short greedy generation before reporting ready, and how many recent
+# requests per route /api/status summarizes
+WARMUP_ON_START = env_bool("WARMUP_ON_START", True)
+WARMUP_TOKENS = env_int("WARMUP_TOKENS", 8)
+STATUS_LATENCY_WINDOW = env_int("STATUS_LATENCY_WINDOW", 1000)
+
+# Bulk /api/chat/batch jobs: items per request, and how many are queued at once
+# (0 = TENANT_MAX_QUEUED plus one full batch per worker)
+BULK_MAX_ITEMS = env_int("BULK_MAX_ITEMS", 1000)
+BULK_MAX_IN_FLIGHT = env_int("BULK_MAX_IN_FLIGHT", 0)
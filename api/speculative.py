@@ -0,0 +1,211 @@
+# api/speculative.py
+"""Speculative decoding for greedy, single-row generation on CPU.
+
+Decoding one token costs a full pass over the model weights, and on CPU that
+pass is bound by memory bandwidth rather than compute, so checking several
+tokens in one forward pass costs little more than producing one. A cheap
+drafter proposes the next few tokens; the full model scores them all at
+once and keeps the longest prefix that matches its own greedy choice, plus
+one token of its own. The output is identical to plain greedy ``generate``.
+
+Drafters:
+
+* ``PromptLookupDrafter`` copies the tokens that followed the latest n-gram
+  the last time it appeared in the prompt or reply (good for quoting,
+  summarizing and code edits; free to run).
+* ``DraftModelDrafter`` runs a small model that shares the tokenizer.
+"""
+import collections
+import threading
+
+import torch
+from transformers import DynamicCache
+
+import metrics
+from engines import DecodeState
+
+DECODING_MODES = ("standard", "prompt_lookup", "draft_model")
+
+
+class PromptLookupDrafter:
+    """Draft tokens by n-gram lookup in the sequence generated so far."""
+
+    name = "prompt_lookup"
+
+    def __init__(self, num_tokens=5, max_ngram=3):
+        self.num_tokens = num_tokens
+        self.max_ngram = max_ngram
+
+    def start(self):
+        return self
+
+    def propose(self, ids):
+        """Tokens that followed the most recent earlier match of the trailing n-gram."""
+        for n in range(min(self.max_ngram, len(ids) - 1), 0, -1):
+            tail = ids[-n:]
+            # Latest match first: recent context predicts best
+            for start in range(len(ids) - n - 1, -1, -1):
+                if ids[start:start + n] == tail:
+                    follow = ids[start + n:start + n + self.num_tokens]
+                    if follow:
+                        return follow
+        return []
+
+
+class DraftModelDrafter:
+    """Draft tokens greedily with a small model that shares the main model's vocabulary."""
+
+    name = "draft_model"
+
+    def __init__(self, draft_model, num_tokens=5):
+        self.model = draft_model
+        self.num_tokens = num_tokens
+        # One generation at a time per draft model; workers share it
+        self.lock = threading.Lock()
+
+    def start(self):
+        return _DraftModelRun(self)
+
+
+class _DraftModelRun:
+    """Per-generation state of a DraftModelDrafter: its own KV cache and the ids it covers."""
+
+    def __init__(self, drafter):
+        self.drafter = drafter
+        self.cache = DynamicCache()
+        self.cached_ids = []
+
+    def propose(self, ids):
+        model = self.drafter.model
+        # Keep the part of the draft cache that the verifier accepted
+        keep = 0
+        for a, b in zip(self.cached_ids, ids[:-1]):
+            if a != b:
+                break
+            keep += 1
+        if keep < self.cache.get_seq_length():
+            self.cache.crop(keep)
+        self.cached_ids = self.cached_ids[:keep]
+
+        draft = []
+        pending = ids[keep:]
+        with self.drafter.lock:
+            for _ in range(self.drafter.num_tokens):
+                logits = model(
+                    input_ids=torch.tensor([pending], device=model.device),
+                    past_key_values=self.cache,
+                    use_cache=True,
+                ).logits
+                self.cached_ids.extend(pending)
+                token = int(logits[0, -1].argmax())
+                draft.append(token)
+                pending = [token]
+        return draft
+
+
+class SpeculativeStats:
+    """Running counts of drafted and accepted tokens across all generations."""
+
+    def __init__(self):
+        self.generations = 0
+        self.steps = 0
+        self.tokens = 0
+        self.drafted = 0
+        self.accepted = 0
+        self._lock = threading.Lock()
+
+    def record(self, steps, tokens, drafted, accepted):
+        with self._lock:
+            self.generations += 1
+            self.steps += steps
+            self.tokens += tokens
+            self.drafted += drafted
+            self.accepted += accepted
+        metrics.SPECULATIVE_TOKENS.labels("drafted").inc(drafted)
+        metrics.SPECULATIVE_TOKENS.labels("accepted").inc(accepted)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "generations": self.generations,
+                "drafted_tokens": self.drafted,
+                "accepted_tokens": self.accepted,
+                "acceptance_rate": round(self.accepted / self.drafted, 3) if self.drafted else 0.0,
+                "tokens_per_forward_pass": round(self.tokens / self.steps, 3) if self.steps else 0.0,
+            }
+
+
+# Shared by every generation in this process; reported by /api/stats
+stats = SpeculativeStats()
+
+SpeculativeResult = collections.namedtuple("SpeculativeResult", "sequences steps drafted accepted")
+
+
+def speculative_generate(engine, prompt_ids, drafter, max_new_tokens, eos_token_id,
+                         should_stop=None, past_key_values=None, on_first_token=None):
+    """Greedy generation that verifies drafted tokens in batches.
+
+    Prefill and verification run through the engine (see engines.py), which
+    must support ``SPECULATIVE`` so it can rewind its KV cache. ``should_stop(ids)`` is checked
+    after every verification step with the full sequence so far.
+    ``past_key_values`` may hold a prefilled prefix of the prompt (e.g. from
+    the prefix cache). Returns a ``SpeculativeResult`` whose ``sequences`` is
+    a ``[1, prompt + generated]`` tensor like the output of ``generate``.
+    """
+    state = None
+    if past_key_values is not None:
+        state = DecodeState(past_key_values, past_key_values.get_seq_length())
+    run = drafter.start()
+    ids = list(prompt_ids)
+    prompt_length = len(ids)
+
+    # Prefill whatever part of the prompt the cache doesn't cover yet
+    logits, state = engine.prefill(ids[state.length if state is not None else 0:], state)
+    ids.append(int(logits.argmax()))
+    if on_first_token is not None:
+        on_first_token()
+    steps = 1
+    drafted = 0
+    accepted = 0
+
+    while True:
+        generated = ids[prompt_length:]
+        if (len(generated) >= max_new_tokens or generated[-1] == eos_token_id
+                or (should_stop is not None and should_stop(ids))):
+            break
+
+        # The last token is not in the cache yet; score it together with the draft
+        draft = run.propose(ids)[:max_new_tokens - len(generated)]
+        cached = state.length
+        logits, state = engine.extend([ids[-1]] + draft, state)
+        predicted = logits.argmax(-1).tolist()
+        steps += 1
+
+        matched = 0
+        while matched < len(draft) and draft[matched] == predicted[matched]:
+            matched += 1
+        drafted += len(draft)
+        accepted += matched
+
+        # Drop the rejected draft tokens from the cache; keep the verifier's own next token
+        state = engine.rewind(state, cached + 1 + matched)
+        new_tokens = draft[:matched] + [predicted[matched]]
+        if eos_token_id in new_tokens:
+            new_tokens = new_tokens[:new_tokens.index(eos_token_id) + 1]
+        ids.extend(new_tokens[:max_new_tokens - len(generated)])
+
+    sequences = torch.tensor([ids], device=engine.device)
+    return SpeculativeResult(sequences, steps, drafted, accepted)
+
+
+def make_drafter(mode, num_tokens=5, max_ngram=3, draft_model=None):
+    """Build the drafter for a DECODING_MODE, or None for plain ``generate``."""
+    if mode not in DECODING_MODES:
+        raise ValueError(f"Unknown decoding mode {mode!r}, expected one of {', '.join(DECODING_MODES)}")
+    if mode == "prompt_lookup":
+        return PromptLookupDrafter(num_tokens=num_tokens, max_ngram=max_ngram)
+    if mode == "draft_model":
+        if draft_model is None:
+            raise ValueError("draft_model decoding needs a draft model (SPECULATIVE_DRAFT_MODEL)")
+        return DraftModelDrafter(draft_model, num_tokens=num_tokens)
+    return None
@@ -0,0 +1,90 @@
+# api/status.py
+"""Model lifecycle phase and recent request latency, for the health and status endpoints."""
+import collections
+import math
+import time
+
+# Lifecycle phases in order; "failed" can follow any of the loading phases
+PHASES = ("starting", "loading", "warming", "ready", "failed")
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class LatencyWindow:
+    """The last ``size`` request latencies and status codes per route."""
+
+    def __init__(self, size=1000):
+        self.size = size
+        self._routes = {}
+
+    def record(self, route, seconds, status):
+        samples = self._routes.get(route)
+        if samples is None:
+            samples = self._routes[route] = collections.deque(maxlen=self.size)
+        samples.append((seconds, status))
+
+    def snapshot(self):
+        routes = {}
+        for route, samples in self._routes.items():
+            latencies = sorted(seconds for seconds, _ in samples)
+            errors = sum(1 for _, status in samples if status >= 500)
+            routes[route] = {
+                "count": len(latencies),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+                "error_rate": round(errors / len(latencies), 4),
+            }
+        return routes
+
+
+class ServiceStatus:
+    """Tracks where model loading is and how long each step took.
+
+    Lives on the event loop; the loader reports each phase as it enters it.
+    """
+
+    def __init__(self, latency_window=1000):
+        self.started_at = time.time()
+        self._started_monotonic = time.monotonic()
+        self.phase = "starting"
+        self.error = None
+        self.phase_seconds = {}
+        self._phase_started = time.monotonic()
+        self.latency = LatencyWindow(latency_window)
+
+    def enter(self, phase, error=None):
+        if phase not in PHASES:
+            raise ValueError(f"Unknown phase {phase!r}")
+        now = time.monotonic()
+        self.phase_seconds[self.phase] = round(now - self._phase_started, 2)
+        self.phase = phase
+        self.error = error
+        self._phase_started = now
+
+    @property
+    def ready(self):
+        return self.phase == "ready"
+
+    @property
+    def failed(self):
+        return self.phase == "failed"
+
+    def uptime(self):
+        return time.monotonic() - self._started_monotonic
+
+    def snapshot(self):
+        return {
+            "phase": self.phase,
+            "ready": self.ready,
+            "error": self.error,
+            "phase_seconds": dict(self.phase_seconds),
+            "in_phase_seconds": round(time.monotonic() - self._phase_started, 2),
+            "uptime_seconds": round(self.uptime(), 1),
+            "started_at": self.started_at,
+            "latency": self.latency.snapshot(),
+        }
@@ -0,0 +1,64 @@
+# benchmarks/bench_cold_start.py
+"""Compare cold-start time and peak RSS of the runtime-merge and pre-merged load paths."""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+sys.path.insert(0, API_DIR)
+
+import settings
+
+
+def load_once(path, adapter, base_model, merged):
+    """Run in a fresh process: load through one path and print the stats as JSON."""
+    from model_loader import load_model_and_tokenizer
+
+    # An empty merged path forces the runtime PEFT merge
+    merged_path = merged if path == "merged" else ""
+    _, _, info = load_model_and_tokenizer(adapter, base_model, merged_path)
+    print("RESULT " + json.dumps(info))
+
+
+def run_child(path, args):
+    command = [
+        sys.executable, os.path.abspath(__file__), "--child", path,
+        "--adapter", args.adapter, "--base-model", args.base_model, "--merged", args.merged,
+    ]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    for line in output.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"No result from {path} load:\n{output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model cold start")
+    parser.add_argument("--adapter", default=settings.MODEL_PATH)
+    parser.add_argument("--base-model", default=settings.BASE_MODEL)
+    parser.add_argument("--merged", default=settings.MERGED_MODEL_PATH)
+    parser.add_argument("--runs", type=int, default=3, help="Cold starts per path")
+    parser.add_argument("--child", choices=["merge", "merged"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        load_once(args.child, args.adapter, args.base_model, args.merged)
+        return
+
+    paths = ["merge"]
+    if os.path.exists(os.path.join(args.merged, "merge_info.json")):
+        paths.append("merged")
+    else:
+        print(f"No pre-merged checkpoint at {args.merged}; run api/merge_model.py first")
+
+    print(f"{'path':<8} {'run':>3} {'source':<8} {'seconds':>8} {'peak RSS MB':>12}")
+    for path in paths:
+        for run in range(1, args.runs + 1):
+            info = run_child(path, args)
+            print(f"{path:<8} {run:>3} {info['source']:<8} {info['load_seconds']:>8.2f} {info['peak_rss_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
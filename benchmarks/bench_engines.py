@@ -0,0 +1,150 @@
+# benchmarks/bench_engines.py
+"""Compare inference engines side by side: prefill latency, per-token decode latency and throughput."""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+sys.path.insert(0, API_DIR)
+
+import settings
+from bench_precision import PROMPTS, SYSTEM_PROMPT, token_agreement
+from status import percentile
+
+
+def run_engine(name, args):
+    """Run in a fresh process: load one engine, time it and print the stats as JSON."""
+    import torch
+    import engines
+    from model_loader import current_rss_mb
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    engine = engines.create_engine(
+        name,
+        adapter_path=args.adapter,
+        base_model=args.base_model,
+        merged_path=args.merged,
+        onnx_path=args.onnx,
+        threads=args.threads,
+    )
+    _, tokenizer, info = engine.load()
+    prompts = [
+        tokenizer.apply_chat_template([
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ])
+        for prompt in PROMPTS
+    ]
+
+    # Warm up kernels, allocator and session before timing
+    engine.prefill(prompts[0])
+
+    # Step by step, so prefill and each decode step are timed on their own
+    # (greedy argmax, so both engines should pick the same tokens)
+    prefill_ms, step_ms, outputs = [], [], []
+    for prompt_ids in prompts:
+        start = time.perf_counter()
+        logits, state = engine.prefill(prompt_ids)
+        prefill_ms.append((time.perf_counter() - start) * 1000)
+        tokens = []
+        for _ in range(args.max_new_tokens):
+            token = int(logits.argmax())
+            tokens.append(token)
+            if token == tokenizer.eos_token_id:
+                break
+            start = time.perf_counter()
+            logits, state = engine.decode_step(token, state)
+            step_ms.append((time.perf_counter() - start) * 1000)
+        outputs.append(tokens)
+
+    # Whole generate() calls, one prompt at a time and left-padded in one batch
+    generated = 0
+    start = time.perf_counter()
+    for prompt_ids in prompts:
+        input_ids = torch.tensor([prompt_ids])
+        output = engine.generate(
+            input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            max_new_tokens=args.max_new_tokens,
+            do_sample=False,
+            pad_token_id=tokenizer.pad_token_id,
+        )
+        generated += output.shape[1] - input_ids.shape[1]
+    sequential_seconds = time.perf_counter() - start
+
+    batch = tokenizer.pad({"input_ids": prompts}, padding=True, return_tensors="pt")
+    start = time.perf_counter()
+    output = engine.generate(
+        batch["input_ids"],
+        attention_mask=batch["attention_mask"],
+        max_new_tokens=args.max_new_tokens,
+        min_new_tokens=args.max_new_tokens,
+        do_sample=False,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    batch_seconds = time.perf_counter() - start
+    batch_tokens = len(prompts) * (output.shape[1] - batch["input_ids"].shape[1])
+
+    prefill_ms.sort()
+    step_ms.sort()
+    result = {
+        "engine": name,
+        "load_seconds": info["load_seconds"],
+        "rss_mb": round(current_rss_mb(), 1),
+        "prefill_p50_ms": round(percentile(prefill_ms, 50), 1),
+        "step_p50_ms": round(percentile(step_ms, 50), 2),
+        "step_p95_ms": round(percentile(step_ms, 95), 2),
+        "tokens_per_second": round(generated / sequential_seconds, 2),
+        "batch_tokens_per_second": round(batch_tokens / batch_seconds, 2),
+        "outputs": outputs,
+    }
+    print("RESULT " + json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inference engines side by side")
+    parser.add_argument("--engines", default="torch,onnx", help="Comma-separated engines")
+    parser.add_argument("--adapter", default=settings.MODEL_PATH)
+    parser.add_argument("--base-model", default=settings.BASE_MODEL)
+    parser.add_argument("--merged", default=settings.MERGED_MODEL_PATH)
+    parser.add_argument("--onnx", default=settings.ONNX_MODEL_PATH, help="ONNX export directory")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="Torch/ONNX Runtime threads (0 = default)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_engine(args.child, args)
+        return
+
+    results = {}
+    for name in [e.strip() for e in args.engines.split(",") if e.strip()]:
+        print(f"Running {name}...")
+        command = [
+            sys.executable, os.path.abspath(__file__), "--child", name,
+            "--adapter", args.adapter, "--base-model", args.base_model, "--merged", args.merged,
+            "--onnx", args.onnx, "--max-new-tokens", str(args.max_new_tokens), "--threads", str(args.threads),
+        ]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        for line in output.splitlines():
+            if line.startswith("RESULT "):
+                results[name] = json.loads(line[len("RESULT "):])
+
+    # Both engines decode greedily from the same weights, so outputs should agree
+    reference = results.get("torch", {}).get("outputs")
+    print(f"\n{'engine':<7} {'prefill ms':>10} {'step p50':>9} {'step p95':>9} {'tok/s':>8} "
+          f"{'batch tok/s':>12} {'RSS MB':>8} {'load s':>7} {'agree':>6}")
+    for name, result in results.items():
+        agreement = f"{token_agreement(reference, result['outputs']):.2f}" if reference else "n/a"
+        print(f"{name:<7} {result['prefill_p50_ms']:>10.1f} {result['step_p50_ms']:>9.2f} "
+              f"{result['step_p95_ms']:>9.2f} {result['tokens_per_second']:>8.2f} "
+              f"{result['batch_tokens_per_second']:>12.2f} {result['rss_mb']:>8.0f} "
+              f"{result['load_seconds']:>7.1f} {agreement:>6}")
+
+
+if __name__ == "__main__":
+    main()
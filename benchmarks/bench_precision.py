@@ -0,0 +1,130 @@
+# benchmarks/bench_precision.py
+"""Compare fp32, bf16 and int8 CPU inference: tokens/sec, resident memory and output quality."""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+sys.path.insert(0, API_DIR)
+
+import settings
+
+# Fixed prompt set so every mode is measured on the same work
+PROMPTS = [
+    "hi",
+    "what's up",
+    "explain what a mutex is in one sentence",
+    "can you recommend a good sci-fi book?",
+    "write a haiku about discord bots",
+    "what is the capital of australia?",
+]
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+def run_mode(precision, args):
+    """Run in a fresh process: load one precision, generate greedily and print the stats as JSON."""
+    import torch
+    from model_loader import current_rss_mb, load_model_and_tokenizer
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    model, tokenizer, info = load_model_and_tokenizer(
+        args.adapter, args.base_model, args.merged, precision=precision
+    )
+
+    outputs = []
+    generated = 0
+    elapsed = 0.0
+    for prompt in PROMPTS:
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+        input_ids = tokenizer.apply_chat_template(messages, return_tensors="pt")
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                max_new_tokens=args.max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        elapsed += time.perf_counter() - start
+        new_tokens = output[0][input_ids.shape[1]:].tolist()
+        generated += len(new_tokens)
+        outputs.append(new_tokens)
+
+    result = {
+        "precision": precision,
+        "load_seconds": info["load_seconds"],
+        "rss_mb": round(current_rss_mb(), 1),
+        "peak_rss_mb": info["peak_rss_mb"],
+        "tokens": generated,
+        "tokens_per_second": round(generated / elapsed, 2) if elapsed else 0.0,
+        "outputs": outputs,
+        "samples": [tokenizer.decode(tokens, skip_special_tokens=True) for tokens in outputs[:2]],
+    }
+    print("RESULT " + json.dumps(result))
+
+
+def token_agreement(reference, candidate):
+    """Fraction of reference tokens reproduced before the first divergence, averaged over prompts."""
+    scores = []
+    for ref, cand in zip(reference, candidate):
+        matched = 0
+        for a, b in zip(ref, cand):
+            if a != b:
+                break
+            matched += 1
+        scores.append(matched / len(ref) if ref else 1.0)
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CPU inference precision modes")
+    parser.add_argument("--modes", default="fp32,bf16,int8", help="Comma-separated precision modes")
+    parser.add_argument("--adapter", default=settings.MODEL_PATH)
+    parser.add_argument("--base-model", default=settings.BASE_MODEL)
+    parser.add_argument("--merged", default=settings.MERGED_MODEL_PATH)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="Torch threads (0 = default)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_mode(args.child, args)
+        return
+
+    results = {}
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        print(f"Running {mode}...")
+        command = [
+            sys.executable, os.path.abspath(__file__), "--child", mode,
+            "--adapter", args.adapter, "--base-model", args.base_model, "--merged", args.merged,
+            "--max-new-tokens", str(args.max_new_tokens), "--threads", str(args.threads),
+        ]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        for line in output.splitlines():
+            if line.startswith("RESULT "):
+                results[mode] = json.loads(line[len("RESULT "):])
+
+    # Quality is measured as greedy-output agreement with the fp32 reference
+    reference = results.get("fp32", {}).get("outputs")
+    print(f"\n{'mode':<6} {'tok/s':>8} {'RSS MB':>8} {'peak MB':>8} {'load s':>7} {'agree':>6}")
+    for mode, result in results.items():
+        agreement = f"{token_agreement(reference, result['outputs']):.2f}" if reference else "n/a"
+        print(f"{mode:<6} {result['tokens_per_second']:>8.2f} {result['rss_mb']:>8.0f} "
+              f"{result['peak_rss_mb']:>8.0f} {result['load_seconds']:>7.1f} {agreement:>6}")
+
+    print("\nSample replies:")
+    for mode, result in results.items():
+        for sample in result["samples"]:
+            print(f"  [{mode}] {sample[:100]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# benchmarks/bench_prefix_cache.py
+"""Measure the prefill time saved by reusing the cached system-prompt prefix."""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import engines
+import settings
+from prefix_cache import PrefixCache
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+USER_TURNS = [
+    "hi",
+    "what's up",
+    "can you recommend a good sci-fi book?",
+    "explain what a mutex is in one sentence",
+    "who won the game last night?",
+    "write a haiku about discord bots",
+    "how do I center a div",
+    "tell me a joke about python programmers",
+]
+
+
+def time_prefill(model, input_ids, past_key_values=None):
+    start = time.perf_counter()
+    with torch.no_grad():
+        model(input_ids=input_ids, past_key_values=past_key_values, use_cache=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prefix KV-cache reuse")
+    parser.add_argument("--model", default=settings.BASE_MODEL, help="Model to load")
+    parser.add_argument("--system-prompt", default=SYSTEM_PROMPT)
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per prompt")
+    parser.add_argument("--threads", type=int, default=0, help="Torch threads (0 = default)")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    print(f"Loading {args.model}...")
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32, device_map="cpu")
+    model.eval()
+    # The prefix cache prefills through the serving engine
+    engine = engines.TorchEngine(adapter_path=None, base_model=args.model, merged_path=None)
+    engine.adopt(model, tokenizer, {})
+
+    cache = PrefixCache(max_entries=4, min_tokens=1)
+    full_times = []
+    cached_times = []
+
+    for turn in USER_TURNS:
+        messages = [
+            {"role": "system", "content": args.system_prompt},
+            {"role": "user", "content": turn},
+        ]
+        prompt_ids = tokenizer.apply_chat_template(messages)
+        input_ids = torch.tensor([prompt_ids])
+
+        # Warm the prefix entry and the kernels before timing
+        prefix_state = cache.lookup(engine, tokenizer, messages, prompt_ids)
+        if prefix_state is None:
+            print(f"No reusable prefix for: {turn}")
+            continue
+        prefix_length = prefix_state.get_seq_length()
+        time_prefill(model, input_ids)
+
+        for _ in range(args.repeats):
+            full_times.append(time_prefill(model, input_ids))
+
+            start = time.perf_counter()
+            past_key_values = cache.lookup(engine, tokenizer, messages, prompt_ids)
+            lookup_time = time.perf_counter() - start
+            cached_times.append(lookup_time + time_prefill(model, input_ids[:, prefix_length:], past_key_values))
+
+        print(f"{len(prompt_ids):4d} prompt tokens, {prefix_length:3d} from cache: {turn}")
+
+    full_ms = statistics.median(full_times) * 1000
+    cached_ms = statistics.median(cached_times) * 1000
+    print("\nMedian prefill per request")
+    print(f"  full prompt:        {full_ms:8.2f} ms")
+    print(f"  cached prefix:      {cached_ms:8.2f} ms (including cache copy)")
+    print(f"  saved per request:  {full_ms - cached_ms:8.2f} ms ({(1 - cached_ms / full_ms) * 100:.1f}%)")
+    print(f"  cache stats:        {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
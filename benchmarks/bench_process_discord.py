@@ -0,0 +1,117 @@
+# benchmarks/bench_process_discord.py
+"""Scaling of scripts/process_discord.py over worker processes on a synthetic Discord export."""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from process_discord import process_discord_export
+
+WORDS = ("hey anyone up for a game tonight lol the bot is down again check the pinned "
+         "message python discord server thanks gg nice one").split()
+NOISE = ("<@123456789012345678>", "<#876543210987654321>", "<:pepe:112233445566778899>",
+         "https://example.com/some/link", "<a:dance:998877665544332211>")
+
+
+def make_export(root, channels, files_per_channel, messages_per_file, seed):
+    """Write a synthetic export laid out like Discord's: one directory per channel."""
+    rng = random.Random(seed)
+    message_count = 0
+    for channel in range(channels):
+        channel_dir = os.path.join(root, f"c{channel:05d}")
+        os.makedirs(channel_dir)
+        for index in range(files_per_channel):
+            messages = []
+            for _ in range(messages_per_file):
+                words = [rng.choice(WORDS) for _ in range(rng.randint(1, 30))]
+                if rng.random() < 0.3:
+                    words.insert(rng.randrange(len(words) + 1), rng.choice(NOISE))
+                messages.append({
+                    "ID": rng.getrandbits(62),
+                    "Timestamp": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+                                 f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+                    "Contents": " ".join(words),
+                    "AuthorID": rng.getrandbits(40),
+                    "AuthorName": f"user{rng.randint(1, 500)}",
+                })
+            with open(os.path.join(channel_dir, f"messages_{index}.json"), "w", encoding="utf-8") as f:
+                json.dump(messages, f)
+            message_count += messages_per_file
+    return message_count
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def worker_counts(max_workers):
+    counts, workers = [], 1
+    while workers < max_workers:
+        counts.append(workers)
+        workers *= 2
+    return counts + [max_workers]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark process_discord.py across worker counts")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--files-per-channel", type=int, default=5)
+    parser.add_argument("--messages-per-file", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per worker count (best is kept)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="discord-export-")
+    try:
+        export_dir = os.path.join(root, "export")
+        os.makedirs(export_dir)
+        messages = make_export(export_dir, args.channels, args.files_per_channel, args.messages_per_file, args.seed)
+        files = args.channels * args.files_per_channel
+        print(f"Synthetic export: {files} files, {messages} messages")
+
+        results = []
+        reference = None
+        for workers in worker_counts(args.max_workers):
+            output = os.path.join(root, f"out-{workers}.jsonl")
+            best = None
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                # The script reports progress on stdout and stderr; keep the table readable
+                with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                    process_discord_export(export_dir, output, workers)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            digest = file_digest(output)
+            reference = reference or digest
+            results.append((workers, best, digest == reference))
+            print(f"workers={workers}: {best:.2f}s")
+
+        baseline = results[0][1]
+        print(f"\n{'workers':>7} {'seconds':>8} {'files/s':>9} {'msgs/s':>10} {'speedup':>8} {'effic.':>7} {'same':>5}")
+        for workers, seconds, same in results:
+            speedup = baseline / seconds
+            print(f"{workers:>7} {seconds:>8.2f} {files / seconds:>9.0f} {messages / seconds:>10.0f} "
+                  f"{speedup:>7.2f}x {speedup / workers:>7.2f} {'yes' if same else 'NO':>5}")
+        if not all(same for _, _, same in results):
+            print("\nOutput differs between worker counts")
+            sys.exit(1)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# benchmarks/bench_process_discord_memory.py
+"""Peak RSS of scripts/process_discord.py against export size, in-memory vs --stream.
+
+Both modes sort the output with the external sort, so stream mode's peak is
+bounded by --sort-memory-mb rather than by the export.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+from bench_process_discord import NOISE, WORDS
+
+
+def write_channel(path, target_mb, seed):
+    """Write one channel file of about ``target_mb`` MB, a message at a time."""
+    rng = random.Random(seed)
+    target = target_mb * 1024 * 1024
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        while written < target:
+            words = [rng.choice(WORDS) for _ in range(rng.randint(1, 40))]
+            if rng.random() < 0.3:
+                words.insert(rng.randrange(len(words) + 1), rng.choice(NOISE))
+            message = json.dumps({
+                "ID": rng.getrandbits(62),
+                "Timestamp": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T"
+                             f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00",
+                "Contents": " ".join(words),
+                "AuthorID": rng.getrandbits(40),
+                "AuthorName": f"user{rng.randint(1, 500)}",
+            })
+            f.write(("," if written else "") + message)
+            written += len(message) + 1
+        f.write("]")
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_child(mode, export_dir, output, sort_memory_mb):
+    """Run in a fresh process so peak RSS covers this mode alone."""
+    from process_discord import process_discord_export
+
+    sys.stdout = open(os.devnull, "w")
+    start = time.perf_counter()
+    stats = process_discord_export(export_dir, output, stream=(mode == "stream"), sort_memory_mb=sort_memory_mb)
+    elapsed = time.perf_counter() - start
+    sys.stdout = sys.__stdout__
+    print("RESULT " + json.dumps({
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "seconds": round(elapsed, 2),
+        "messages": stats.messages,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of process_discord.py by export size")
+    parser.add_argument("--sizes", default="16,64,256", help="Comma-separated export sizes in MB")
+    parser.add_argument("--modes", default="memory,stream", help="memory (json.load + sort) and/or stream")
+    parser.add_argument("--sort-memory-mb", type=int, default=32,
+                        help="Sort buffer before runs spill to disk, which bounds stream mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child, args.sort_memory_mb)
+        return
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    rows = []
+    root = tempfile.mkdtemp(prefix="discord-export-")
+    try:
+        for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+            export_dir = os.path.join(root, f"export-{size}")
+            os.makedirs(os.path.join(export_dir, "general"))
+            write_channel(os.path.join(export_dir, "general", "messages.json"), size, args.seed)
+            for mode in modes:
+                output = os.path.join(root, f"out-{size}-{mode}.jsonl")
+                command = [sys.executable, os.path.abspath(__file__), "--child", mode, export_dir, output,
+                           "--sort-memory-mb", str(args.sort_memory_mb)]
+                stdout = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+                for line in stdout.splitlines():
+                    if line.startswith("RESULT "):
+                        result = json.loads(line[len("RESULT "):])
+                        rows.append((size, mode, result))
+                        print(f"{size} MB {mode}: peak {result['peak_rss_mb']:.0f} MB in {result['seconds']:.1f}s")
+                os.remove(output)
+            shutil.rmtree(export_dir)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"\n{'export MB':>9} {'mode':<7} {'peak RSS MB':>11} {'RSS/export':>10} {'seconds':>8} {'messages':>9}")
+    for size, mode, result in rows:
+        print(f"{size:>9} {mode:<7} {result['peak_rss_mb']:>11.0f} {result['peak_rss_mb'] / size:>10.2f} "
+              f"{result['seconds']:>8.1f} {result['messages']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# benchmarks/bench_speculative.py
+"""Compare plain greedy generate() with speculative decoding: tokens/sec and acceptance rate."""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import engines
+import settings
+import speculative
+from model_loader import load_draft_model
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+# Fixed prompt set: a mix of chit-chat and prompts that quote their input,
+# where prompt-lookup drafts are most useful
+PROMPTS = [
+    "hi",
+    "explain what a mutex is in one sentence",
+    "write a haiku about discord bots",
+    "Repeat this sentence exactly: the quick brown fox jumps over the lazy dog near the river bank.",
+    "Fix the typo in this code and print it back: def add(a, b):\n    retrun a + b",
+    "Summarize: The server keeps one copy of the model in memory. Requests wait in a queue, "
+    "are grouped into batches and are answered by worker threads that own the model.",
+]
+
+
+def run_standard(engine, tokenizer, prompt_ids, max_new_tokens):
+    input_ids = torch.tensor([prompt_ids])
+    output = engine.generate(
+        input_ids,
+        attention_mask=torch.ones_like(input_ids),
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    return output[0][len(prompt_ids):].tolist(), None
+
+
+def run_speculative(engine, tokenizer, prompt_ids, max_new_tokens, drafter):
+    result = speculative.speculative_generate(
+        engine, prompt_ids, drafter, max_new_tokens, tokenizer.eos_token_id
+    )
+    return result.sequences[0][len(prompt_ids):].tolist(), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark speculative decoding against plain generate")
+    parser.add_argument("--modes", default="standard,prompt_lookup",
+                        help=f"Comma-separated decoding modes ({', '.join(speculative.DECODING_MODES)})")
+    parser.add_argument("--adapter", default=settings.MODEL_PATH)
+    parser.add_argument("--base-model", default=settings.BASE_MODEL)
+    parser.add_argument("--merged", default=settings.MERGED_MODEL_PATH)
+    parser.add_argument("--precision", default=settings.INFERENCE_PRECISION)
+    parser.add_argument("--draft-model", default=settings.SPECULATIVE_DRAFT_MODEL,
+                        help="Small model sharing the tokenizer, for the draft_model mode")
+    parser.add_argument("--num-tokens", type=int, default=settings.SPECULATIVE_NUM_TOKENS,
+                        help="Draft tokens verified per forward pass")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="Torch threads (0 = default)")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+
+    # The server's engine, so both modes run the same code paths as in serving
+    engine = engines.create_engine(
+        "torch", adapter_path=args.adapter, base_model=args.base_model, merged_path=args.merged,
+        precision=args.precision,
+    )
+    _, tokenizer, _ = engine.load()
+    draft_model = None
+    if "draft_model" in modes:
+        draft_model = load_draft_model(args.draft_model, args.precision)
+    prompts = [
+        tokenizer.apply_chat_template([
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ])
+        for prompt in PROMPTS
+    ]
+
+    results = {}
+    reference = None
+    for mode in modes:
+        drafter = speculative.make_drafter(mode, num_tokens=args.num_tokens, draft_model=draft_model)
+        outputs = []
+        generated = drafted = accepted = steps = 0
+        elapsed = 0.0
+        with torch.no_grad():
+            # Warm up kernels and allocator before timing
+            run_standard(engine, tokenizer, prompts[0], 4)
+            for prompt_ids in prompts:
+                start = time.perf_counter()
+                if drafter is None:
+                    tokens, result = run_standard(engine, tokenizer, prompt_ids, args.max_new_tokens)
+                else:
+                    tokens, result = run_speculative(engine, tokenizer, prompt_ids, args.max_new_tokens, drafter)
+                elapsed += time.perf_counter() - start
+                outputs.append(tokens)
+                generated += len(tokens)
+                if result is not None:
+                    drafted += result.drafted
+                    accepted += result.accepted
+                    steps += result.steps
+
+        if reference is None and drafter is None:
+            reference = outputs
+        results[mode] = {
+            "tokens_per_second": generated / elapsed if elapsed else 0.0,
+            "acceptance_rate": accepted / drafted if drafted else None,
+            "tokens_per_pass": generated / steps if steps else 1.0,
+            "outputs": outputs,
+        }
+        print(f"{mode}: {generated} tokens in {elapsed:.2f}s")
+
+    # Greedy verification should reproduce plain greedy output token for token
+    print(f"\n{'mode':<14} {'tok/s':>8} {'speedup':>8} {'accept':>7} {'tok/pass':>9} {'same':>5}")
+    baseline = results.get("standard", {}).get("tokens_per_second")
+    for mode, result in results.items():
+        speedup = f"{result['tokens_per_second'] / baseline:.2f}x" if baseline else "n/a"
+        acceptance = f"{result['acceptance_rate']:.2f}" if result["acceptance_rate"] is not None else "-"
+        same = "n/a" if reference is None else ("yes" if result["outputs"] == reference else "no")
+        print(f"{mode:<14} {result['tokens_per_second']:>8.2f} {speedup:>8} {acceptance:>7} "
+              f"{result['tokens_per_pass']:>9.2f} {same:>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# benchmarks/load_test.py
+"""HTTP load test for /api/chat with latency regression checks against a stored baseline.
+
+Boots the API in a child process on 127.0.0.1, either with the real model or
+with a deterministic stub that costs a fixed time per prompt token and per
+decoded token, then drives it with a fixed number of concurrent clients.
+Everything runs locally; nothing is downloaded in stub mode.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import zlib
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+sys.path.insert(0, API_DIR)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "load_test.json")
+
+# Words per prompt and how often each length is drawn
+DEFAULT_PROMPT_MIX = "8:0.6,64:0.3,256:0.1"
+WORDS = ("discord bot model token cache queue batch thread server reply channel "
+         "message prompt latency memory python fast slow test").split()
+# Metrics compared with the baseline: lower is better for latency, higher for throughput
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "error_rate")
+HIGHER_IS_BETTER = ("throughput_rps",)
+
+
+class StubTokenizer:
+    """Whitespace tokenizer with the chat-template call the API relies on."""
+
+    eos_token_id = 0
+    pad_token_id = 0
+
+    def apply_chat_template(self, messages, **kwargs):
+        ids = []
+        for message in messages:
+            ids.append(zlib.crc32(message["role"].encode()) % 1000 + 1)
+            ids.extend(zlib.crc32(word.encode()) % 30000 + 1 for word in message["content"].split())
+        return ids
+
+
+class StubBackend:
+    """Stands in for generate_batch: sleeps for a fixed cost per token and returns fixed text.
+
+    A batch pays prefill for every prompt token it holds, but one decode step
+    per generated token regardless of its size, like the memory-bound CPU model.
+    """
+
+    def __init__(self, prefill_ms, token_ms, reply_tokens):
+        self.prefill_seconds = prefill_ms / 1000
+        self.token_seconds = token_ms / 1000
+        self.reply_tokens = reply_tokens
+
+    def generate_batch(self, model, tokenizer, items, controls=None, prefix_cache=None, drafter=None):
+        prompt_tokens = sum(len(tokenizer.apply_chat_template(messages)) for messages, _ in items)
+        time.sleep(prompt_tokens * self.prefill_seconds)
+        lengths = [min(params.max_new_tokens, self.reply_tokens) for _, params in items]
+        controls = controls or [None] * len(items)
+        for _ in range(max(lengths)):
+            if all(control is not None and control.should_stop() for control in controls):
+                break
+            time.sleep(self.token_seconds)
+        return [" ".join(WORDS[i % len(WORDS)] for i in range(length)) for length in lengths]
+
+
+def serve(args):
+    """Child process: run the API on 127.0.0.1 with the chosen backend."""
+    import uvicorn
+    import main
+
+    if args.backend == "stub":
+        backend = StubBackend(args.stub_prefill_ms, args.stub_token_ms, args.stub_reply_tokens)
+        main.use_preloaded_model(object(), StubTokenizer(), {"source": "stub", "load_seconds": 0})
+        # The background loader builds its batch function from this
+        main.generate_batch = backend.generate_batch
+
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_mix(mix):
+    lengths, weights = [], []
+    for part in mix.split(","):
+        words, weight = part.split(":")
+        lengths.append(int(words))
+        weights.append(float(weight))
+    return lengths, weights
+
+
+def make_prompts(count, mix, seed):
+    """Deterministic prompt sequence drawn from the length distribution."""
+    rng = random.Random(seed)
+    lengths, weights = parse_mix(mix)
+    prompts = []
+    for index in range(count):
+        length = rng.choices(lengths, weights)[0]
+        words = [rng.choice(WORDS) for _ in range(length)]
+        # Unique per request so the response cache never answers
+        prompts.append(f"request {index}: " + " ".join(words))
+    return prompts
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+async def wait_ready(client, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health/ready")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"API did not become ready within {timeout}s")
+
+
+async def drive(base_url, prompts, args):
+    import httpx
+
+    latencies = []
+    statuses = {}
+    queue = collections.deque(prompts)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout) as client:
+        await wait_ready(client, args.ready_timeout)
+
+        async def client_loop():
+            while queue:
+                prompt = queue.popleft()
+                body = {
+                    "messages": [
+                        {"role": "system", "content": "You are a helpful assistant."},
+                        {"role": "user", "content": prompt},
+                    ],
+                    "max_new_tokens": args.max_new_tokens,
+                }
+                start = time.perf_counter()
+                try:
+                    status = (await client.post("/api/chat", json=body)).status_code
+                except Exception as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started_at
+
+    ok = statuses.get(200, 0)
+    return {
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(ok / elapsed, 3) if elapsed else 0.0,
+        "error_rate": round(1 - ok / len(latencies), 4) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "statuses": {str(k): v for k, v in statuses.items()},
+    }
+
+
+def scenario_name(args):
+    return f"{args.backend}-c{args.concurrency}-n{args.requests}-t{args.max_new_tokens}-{args.prompt_mix}"
+
+
+def compare(result, baseline, tolerance):
+    """Return (metric, baseline, current, change) rows and whether any regressed past tolerance."""
+    rows = []
+    regressed = False
+    for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+        old, new = baseline.get(metric), result.get(metric)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+        # An error rate going from zero to anything is a regression
+        if metric == "error_rate" and old == 0:
+            worse = new > 0
+        regressed = regressed or worse
+        rows.append((metric, old, new, change, worse))
+    return rows, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /api/chat and compare against a baseline")
+    parser.add_argument("--backend", choices=["stub", "real"], default="stub",
+                        help="stub costs a fixed time per token; real loads the configured model")
+    parser.add_argument("--concurrency", "-c", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--requests", "-n", type=int, default=200, help="Total requests")
+    parser.add_argument("--prompt-mix", default=DEFAULT_PROMPT_MIX,
+                        help=f"words:weight pairs for prompt lengths (default: {DEFAULT_PROMPT_MIX})")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stub-prefill-ms", type=float, default=0.2, help="Stub cost per prompt token")
+    parser.add_argument("--stub-token-ms", type=float, default=20.0, help="Stub cost per decode step")
+    parser.add_argument("--stub-reply-tokens", type=int, default=24, help="Tokens in each stub reply")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--verbose", action="store_true", help="Show the server's output")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    port = free_port()
+    command = [
+        sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+        "--backend", args.backend,
+        "--stub-prefill-ms", str(args.stub_prefill_ms),
+        "--stub-token-ms", str(args.stub_token_ms),
+        "--stub-reply-tokens", str(args.stub_reply_tokens),
+    ]
+    output = None if args.verbose else subprocess.DEVNULL
+    server = subprocess.Popen(command, stdout=output, stderr=output)
+    try:
+        prompts = make_prompts(args.requests, args.prompt_mix, args.seed)
+        result = asyncio.run(drive(f"http://127.0.0.1:{port}", prompts, args))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    name = scenario_name(args)
+    print(f"\nScenario {name}")
+    print(f"  requests:    {result['requests']} ({result['statuses']})")
+    print(f"  throughput:  {result['throughput_rps']:.2f} req/s")
+    print(f"  error rate:  {result['error_rate'] * 100:.2f}%")
+    print(f"  latency:     p50 {result['p50_ms']:.0f} ms, p95 {result['p95_ms']:.0f} ms, p99 {result['p99_ms']:.0f} ms")
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines[name] = result
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"\nSaved baseline for {name} to {args.baseline}")
+        return
+
+    if name not in baselines:
+        print(f"\nNo baseline for this scenario in {args.baseline}; rerun with --save-baseline to create one")
+        return
+
+    rows, regressed = compare(result, baselines[name], args.tolerance)
+    print(f"\n{'metric':<16} {'baseline':>10} {'current':>10} {'change':>8}")
+    for metric, old, new, change, worse in rows:
+        flag = "  REGRESSION" if worse else ""
+        print(f"{metric:<16} {old:>10.3f} {new:>10.3f} {change * 100:>7.1f}%{flag}")
+    if regressed:
+        print(f"\nRegression beyond {args.tolerance * 100:.0f}% tolerance")
+        sys.exit(1)
+    print("\nWithin tolerance of the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -41,7 +41,9 @@ client.on('messageCreate', async (message) => {
                 messages: [
                     { role: 'system', content: 'You are a helpful assistant.' },
                     { role: 'user', content: prompt }
-                ]
+                ],
+                // Lets the API share generation time fairly between channels
+                tenant: message.channel.id
             })
         });
 
@@ -0,0 +1,78 @@
+# scripts/message_cleaner.py
+"""Message cleaning: strips Discord markup from message text.
+
+Rules are named regexes. A MessageCleaner compiles the rules it is given
+into one alternation, so a message takes a single regex pass plus the
+whitespace collapse however many rules are enabled, and messages with none
+of the rules' trigger substrings skip the regex altogether.
+"""
+import re
+
+# name -> (pattern, trigger substrings, any of which a match must contain)
+RULES = {
+    # Fenced code blocks go first so mentions and URLs inside them go with the block
+    'code_blocks': (r'```.*?```', ('```',)),
+    'user_mentions': (r'<@!?\d+>', ('<@',)),
+    'role_mentions': (r'<@&\d+>', ('<@&',)),
+    'channel_mentions': (r'<#\d+>', ('<#',)),
+    'custom_emojis': (r'<a?:\w+:\d+>', ('<:', '<a:')),
+    'stickers': (r'<sticker:(?:\w+:)?\d+>', ('<sticker:',)),
+    'urls': (r'https?://\S+', ('http://', 'https://')),
+}
+
+# What clean_message has always removed
+DEFAULT_RULES = ('user_mentions', 'channel_mentions', 'custom_emojis', 'urls')
+EXTRA_RULES = tuple(name for name in RULES if name not in DEFAULT_RULES)
+
+class MessageCleaner:
+    """Removes the enabled rules' matches from message text and collapses whitespace."""
+
+    def __init__(self, rules=DEFAULT_RULES):
+        unknown = [name for name in rules if name not in RULES]
+        if unknown:
+            raise ValueError(f"Unknown cleaning rules {', '.join(unknown)}, expected any of {', '.join(RULES)}")
+        # RULES order, not argument order: it decides which rule wins an overlap
+        self.rules = tuple(name for name in RULES if name in rules)
+        self.triggers = tuple(sorted({trigger for name in self.rules for trigger in RULES[name][1]}))
+        self.pattern = None
+        if self.rules:
+            self.pattern = re.compile('|'.join(f"(?:{RULES[name][0]})" for name in self.rules), re.DOTALL)
+
+    def config(self):
+        """What the output depends on, for the incremental manifest."""
+        return {'rules': list(self.rules)}
+
+    def clean(self, content):
+        """Clean message content by removing mentions, emojis, etc."""
+        if not content or not isinstance(content, str):
+            return ""
+        if self.pattern is not None and any(trigger in content for trigger in self.triggers):
+            content = self.pattern.sub('', content)
+        return ' '.join(content.split())
+
+    def clean_many(self, contents):
+        """Yield clean(content) for each item of an iterable, without per-call overhead."""
+        sub = self.pattern.sub if self.pattern is not None else None
+        triggers = self.triggers
+        for content in contents:
+            if not content or not isinstance(content, str):
+                yield ""
+                continue
+            if sub is not None:
+                for trigger in triggers:
+                    if trigger in content:
+                        content = sub('', content)
+                        break
+            yield ' '.join(content.split())
+
+def parse_rules(text):
+    """Rule names from a comma-separated list; 'default' and 'all' expand to those sets."""
+    rules = []
+    for name in (part.strip() for part in text.split(',')):
+        if name == 'default':
+            rules.extend(DEFAULT_RULES)
+        elif name == 'all':
+            rules.extend(RULES)
+        elif name:
+            rules.append(name)
+    return rules
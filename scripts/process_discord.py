@@ -1,126 +1,690 @@
 # data_processing/process_discord.py
+import collections
+import hashlib
+import heapq
 import json
-import re
+import math
+import multiprocessing
+import os
 import sys
+import tempfile
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from operator import itemgetter
+
+from message_cleaner import DEFAULT_RULES, RULES, MessageCleaner, parse_rules
+
+# Sort key for records without a usable timestamp; they sort first, in input order
+NO_TIMESTAMP = -(2 ** 63)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Timestamp formats of older exports that fromisoformat doesn't cover
+TIMESTAMP_FORMATS = (
+    '%m/%d/%Y %I:%M %p',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%d-%b-%y %I:%M %p',
+    '%d.%m.%Y %H:%M:%S',
+)
+# Rough per-record cost of a buffered (key, line) pair beyond the line itself
+RECORD_OVERHEAD = 120
+# Smallest --sort-memory-mb; less spills runs so small their count, not size, dominates
+SORT_MIN_MEMORY_MB = 16
+# Most sorted runs merged (and held open) at once
+MERGE_FAN_IN = 64
+# A --stream file's records are held in memory up to this size, then spill to a
+# temporary file, until the file has parsed cleanly
+SEGMENT_BUFFER_BYTES = 8 * 1024 * 1024
+# Bumped whenever record parsing changes, so old manifests and record stores are rebuilt
+MANIFEST_VERSION = 2
+
+# Cleaning rules in effect; worker processes get theirs from the pool initializer
+cleaner = MessageCleaner(DEFAULT_RULES)
+
+def set_cleaner(rules):
+    global cleaner
+    cleaner = MessageCleaner(rules)
 
 def clean_message(content):
     """Clean message content by removing mentions, emojis, etc."""
-    if not content or not isinstance(content, str):
-        return ""
-    # Remove user mentions
-    content = re.sub(r'<@!?\d+>', '', content)
-    # Remove channel mentions
-    content = re.sub(r'<#\d+>', '', content)
-    # Remove custom emojis
-    content = re.sub(r'<a?:\w+:\d+>', '', content)
-    # Remove URLs
-    content = re.sub(r'https?://\S+', '', content)
-    # Remove multiple spaces and trim
-    content = ' '.join(content.split())
-    return content.strip()
-
-def process_discord_export(export_path, output_file):
-    messages = []
-    processed_count = 0
-    error_count = 0
-    file_count = 0
+    return cleaner.clean(content)
+
+def extract_messages(data, channel):
+    """Yield a cleaned record for every usable message in one parsed channel file."""
+    # Messages whose content is being cleaned, in order; stays lazy for --stream
+    pending = collections.deque()
     
-    export_path = Path(export_path)
-    message_files = list(export_path.rglob('*.json'))
-    print(f"Found {len(message_files)} JSON files to process...")
+    def contents():
+        for msg in data:
+            if not isinstance(msg, dict):
+                continue
+            
+            # Get message content
+            content = msg.get('Contents') or msg.get('content') or ''
+            if not content:
+                continue
+            pending.append(msg)
+            yield content
+    
+    # Clean the content
+    for cleaned in cleaner.clean_many(contents()):
+        msg = pending.popleft()
+        if not cleaned:
+            continue
+        
+        # Get timestamp
+        timestamp = msg.get('Timestamp') or msg.get('timestamp') or ''
+        
+        # Get author info (if available)
+        author_id = msg.get('AuthorID') or msg.get('author_id') or ''
+        author_name = msg.get('AuthorName') or msg.get('author_name') or 'unknown'
+        
+        yield {
+            'text': cleaned,
+            'timestamp': timestamp,
+            'author_id': str(author_id),
+            'author_name': str(author_name),
+            'channel': channel,
+            'source': 'discord'
+        }
+
+def timestamp_key(value):
+    """Microseconds since the epoch (UTC) for a timestamp in any of the export formats.
+    
+    Accepts ISO 8601 with or without an offset, epoch seconds or milliseconds
+    and a few older export formats; naive times are taken as UTC. Anything
+    else gets NO_TIMESTAMP.
+    """
+    if isinstance(value, bool) or value is None:
+        return NO_TIMESTAMP
+    if isinstance(value, str):
+        text = value.strip()
+        if not text:
+            return NO_TIMESTAMP
+        try:
+            value = float(text)
+        except ValueError:
+            return datetime_key(text)
+    if not isinstance(value, (int, float)) or not math.isfinite(value):
+        return NO_TIMESTAMP
+    # Epoch seconds, milliseconds or microseconds, told apart by magnitude
+    if abs(value) >= 1e14:
+        return int(value)
+    if abs(value) >= 1e11:
+        return int(value * 1000)
+    return int(value * 1000000)
+
+def datetime_key(text):
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        for fmt in TIMESTAMP_FORMATS:
+            try:
+                parsed = datetime.strptime(text, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            return NO_TIMESTAMP
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return (parsed - EPOCH) // timedelta(microseconds=1)
+
+def keyed_record(record):
+    """(sort key, JSONL line) for a record; its timestamp is parsed once, here."""
+    return timestamp_key(record['timestamp']), json.dumps(record, ensure_ascii=False)
+
+def process_file(json_file):
+    """Parse and clean one export file. Runs in a worker process with --workers.
+    
+    Returns (parsed, records, error): records are keyed_record pairs, parsed
+    is False if the file couldn't be read as JSON, and error describes what
+    went wrong, if anything.
+    """
+    try:
+        with open(json_file, 'r', encoding='utf-8', errors='replace') as f:
+            data = json.load(f)
+    except json.JSONDecodeError as e:
+        return False, [], f"Error decoding JSON in {json_file}: {str(e)}"
+    except Exception as e:
+        return False, [], f"Error processing {json_file}: {str(e)}"
+    
+    # Skip if not a list of messages
+    if not isinstance(data, list):
+        return True, [], None
+    
+    try:
+        return True, [keyed_record(record) for record in extract_messages(data, str(json_file.parent.name))], None
+    except Exception as e:
+        return True, [], f"Error processing {json_file}: {str(e)}"
+
+def iter_json_array(f, chunk_size=64 * 1024):
+    """Yield the elements of a top-level JSON array one at a time.
+    
+    Reads the file in chunks, so only the current element and one chunk are
+    in memory however large the array is. A document that isn't an array is
+    validated like json.load would and yields nothing; so is anything after
+    the closing bracket.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+    
+    def more():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        # Drop what has been consumed so the buffer stays about one element long
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+    
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buf) or not more():
+                return
+    
+    def end_of_array():
+        nonlocal pos
+        pos += 1
+        skip_whitespace()
+        if pos < len(buf):
+            raise json.JSONDecodeError("Extra data", buf, pos)
+    
+    skip_whitespace()
+    if pos >= len(buf):
+        raise json.JSONDecodeError("Expecting value", buf, pos)
+    if buf[pos] != '[':
+        json.loads(buf[pos:] + f.read())
+        return
+    pos += 1
+    skip_whitespace()
+    if pos < len(buf) and buf[pos] == ']':
+        end_of_array()
+        return
     
+    while True:
+        skip_whitespace()
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+            # A number cut at a chunk boundary ("-1" of "-1.5") decodes too, so
+            # only trust a value once the delimiter after it has been read
+            complete = eof or (end < len(buf) and buf[end] in ' \t\r\n,]')
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            more()
+            continue
+        pos = end
+        yield value
+        
+        skip_whitespace()
+        if pos < len(buf) and buf[pos] == ',':
+            pos += 1
+        elif pos < len(buf) and buf[pos] == ']':
+            end_of_array()
+            return
+        else:
+            raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+
+def stream_file(json_file, segment):
+    """Parse one export file incrementally, writing each cleaned record to segment as a key\\tline row.
+    
+    Returns (parsed, count, error) like process_file, with a record count in
+    place of the records. After an error the count is 0 and whatever was
+    written to segment must be discarded, as process_file drops the whole
+    file.
+    """
+    count = 0
+    try:
+        with open(json_file, 'r', encoding='utf-8', errors='replace') as f:
+            for record in extract_messages(iter_json_array(f), str(json_file.parent.name)):
+                key, line = keyed_record(record)
+                segment.write(f"{key}\t{line}\n")
+                count += 1
+    except json.JSONDecodeError as e:
+        return False, 0, f"Error decoding JSON in {json_file}: {str(e)}"
+    except OSError as e:
+        return False, 0, f"Error processing {json_file}: {str(e)}"
+    except Exception as e:
+        return True, 0, f"Error processing {json_file}: {str(e)}"
+    return True, count, None
+
+def stream_file_to_part(task):
+    """Worker side of --stream --workers: write one file's records to its own part file."""
+    json_file, part_path = task
+    with open(part_path, 'w', encoding='utf-8') as out:
+        return stream_file(json_file, out)
+
+def iter_file_results(message_files, workers=1):
+    """Yield process_file results in input order, fanning the files out to a process pool."""
+    if workers <= 1:
+        for json_file in message_files:
+            yield process_file(json_file)
+        return
+    
+    # Small chunks keep workers busy when file sizes vary; imap preserves input
+    # order, so the output is identical to a single-process run
+    with multiprocessing.Pool(workers, initializer=set_cleaner, initargs=(cleaner.rules,)) as pool:
+        yield from pool.imap(process_file, message_files, chunksize=pool_chunksize(message_files, workers))
+
+def pool_chunksize(message_files, workers):
+    return max(1, min(64, len(message_files) // (workers * 8)))
+
+def with_progress(results, total):
+    """Wrap results in a tqdm bar if available; returns (iterator, simple_progress)."""
     try:
         from tqdm import tqdm
-        file_iterator = tqdm(message_files, desc="Processing files")
+        return tqdm(results, total=total, desc="Processing files"), False
     except ImportError:
         print("tqdm not available, showing simple progress...")
-        file_iterator = message_files
+        return results, True
+
+class IngestStats:
+    """File, message and error counts summed over every file, whichever process parsed it."""
+    
+    def __init__(self, simple_progress):
+        self.simple_progress = simple_progress
+        self.files = 0
+        self.messages = 0
+        self.errors = 0
+        # Incremental runs: files reused from the manifest, and files gone since
+        self.skipped = 0
+        self.removed = 0
+    
+    def record(self, parsed, count, error):
+        if parsed:
+            self.files += 1
+        if error:
+            self.errors += 1
+            print(f"\n{error}")
+        self.messages += count
+        
+        # Print progress
+        if parsed and (not self.simple_progress or self.files % 10 == 0):
+            print(f"Processed {self.messages} messages from {self.files} files...", end='\r')
+    
+    def report(self):
+        print(f"\n\nProcessing complete!")
+        print(f"Processed {self.files} files")
+        print(f"Found {self.messages} valid messages")
+        print(f"Encountered {self.errors} errors")
+        if self.skipped or self.removed:
+            print(f"Reused {self.skipped} unchanged files, dropped {self.removed} removed files")
+
+class ExternalSorter:
+    """Sorts (key, line) pairs by key within a memory budget.
+    
+    Pairs are buffered until the budget is used, then sorted and spilled to
+    a temporary run file; write_sorted() k-way merges the runs with what is
+    still buffered. Equal keys keep their insertion order. At most
+    MERGE_FAN_IN runs are merged at once: every MERGE_FAN_IN runs of one
+    level are merged into a single run of the next, so the number of open
+    run files stays small however large the input is.
+    """
     
-    for json_file in file_iterator:
+    def __init__(self, memory_bytes, tmp_dir=None):
+        self.memory_bytes = memory_bytes
+        self.tmp_dir = tmp_dir
+        self.buffer = []
+        self.buffered_bytes = 0
+        # (level, run file), oldest first; levels never increase along the list
+        self.runs = []
+        self.spilled = 0
+        self.count = 0
+    
+    def add(self, key, line):
+        self.buffer.append((key, line))
+        self.buffered_bytes += len(line) + RECORD_OVERHEAD
+        self.count += 1
+        if self.buffered_bytes >= self.memory_bytes:
+            self._spill()
+    
+    def write_sorted(self, out):
+        self.buffer.sort(key=itemgetter(0))
+        runs = [run for _, run in self.runs]
+        # Leave room for the buffer in the final merge
+        while len(runs) >= MERGE_FAN_IN:
+            runs = [self._merge_runs(runs[i:i + MERGE_FAN_IN]) for i in range(0, len(runs), MERGE_FAN_IN)]
+        # Runs come first: they hold the earlier input, so merge keeps ties in order
+        streams = [self._read_run(run) for run in runs] + [self.buffer]
+        for _, line in heapq.merge(*streams, key=itemgetter(0)):
+            out.write(line + '\n')
+        for run in runs:
+            run.close()
+        self.runs = []
+        self.buffer = []
+    
+    def _spill(self):
+        self.buffer.sort(key=itemgetter(0))
+        run = self._new_run()
+        for key, line in self.buffer:
+            run.write(f"{key}\t{line}\n")
+        run.seek(0)
+        self.runs.append((0, run))
+        self.spilled += 1
+        self.buffer = []
+        self.buffered_bytes = 0
+        # Like a carry: a full level of runs becomes one run of the next level
+        while len(self.runs) >= MERGE_FAN_IN and self.runs[-MERGE_FAN_IN][0] == self.runs[-1][0]:
+            level = self.runs[-1][0]
+            group = [run for _, run in self.runs[-MERGE_FAN_IN:]]
+            del self.runs[-MERGE_FAN_IN:]
+            self.runs.append((level + 1, self._merge_runs(group)))
+    
+    def _new_run(self):
+        return tempfile.TemporaryFile('w+', encoding='utf-8', dir=self.tmp_dir, prefix='sort-run-')
+    
+    def _merge_runs(self, runs):
+        """Merge consecutive runs into one run, closing them; ties keep run order."""
+        merged = self._new_run()
+        for key, line in heapq.merge(*(self._read_run(run) for run in runs), key=itemgetter(0)):
+            merged.write(f"{key}\t{line}\n")
+        merged.seek(0)
+        for run in runs:
+            run.close()
+        return merged
+    
+    @staticmethod
+    def _read_run(run):
+        for row in run:
+            key, line = row.rstrip('\n').split('\t', 1)
+            yield int(key), line
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class Manifest:
+    """Size, mtime and content hash of every source file, and where its records sit in the record store.
+    
+    The record store keeps each file's keyed records as one contiguous
+    segment, so a later run copies the segments of unchanged files instead
+    of parsing them again. Files that failed to parse get no entry and are
+    retried on the next run.
+    """
+    
+    def __init__(self, path, store_path, export_path, options):
+        self.path = Path(path)
+        self.store_path = Path(store_path)
+        self.export_path = Path(export_path)
+        self.options = options
+        self.previous = self._load()
+        self.entries = {}
+        # (json_file, entry) of the files to reuse, in input order
+        self.unchanged = collections.deque()
+        self.skipped = 0
+        self.removed = 0
+        self.store = None
+        self._old_store = None
+        self._new_files = {}
+        self._segment_start = 0
+    
+    def _load(self):
         try:
-            with open(json_file, 'r', encoding='utf-8', errors='replace') as f:
+            with open(self.path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                file_count += 1
-                
-                # Skip if not a list of messages
-                if not isinstance(data, list):
-                    continue
-                
-                for msg in data:
-                    if not isinstance(msg, dict):
-                        continue
-                        
-                    # Get message content
-                    content = msg.get('Contents') or msg.get('content') or ''
-                    if not content:
-                        continue
-                        
-                    # Clean the content
-                    cleaned = clean_message(content)
-                    if not cleaned:
-                        continue
-                    
-                    # Get timestamp
-                    timestamp = msg.get('Timestamp') or msg.get('timestamp') or ''
-                    
-                    # Get author info (if available)
-                    author_id = msg.get('AuthorID') or msg.get('author_id') or ''
-                    author_name = msg.get('AuthorName') or msg.get('author_name') or 'unknown'
-                    
-                    # Add to messages
-                    messages.append({
-                        'text': cleaned,
-                        'timestamp': timestamp,
-                        'author_id': str(author_id),
-                        'author_name': str(author_name),
-                        'channel': str(json_file.parent.name),
-                        'source': 'discord'
-                    })
-                    processed_count += 1
-                    
-            # Print progress
-            if not isinstance(file_iterator, list) or file_count % 10 == 0:
-                print(f"Processed {processed_count} messages from {file_count} files...", end='\r')
-                        
-        except json.JSONDecodeError as e:
-            error_count += 1
-            print(f"\nError decoding JSON in {json_file}: {str(e)}")
-        except Exception as e:
-            error_count += 1
-            print(f"\nError processing {json_file}: {str(e)}")
-    
-    print(f"\n\nProcessing complete!")
-    print(f"Processed {file_count} files")
-    print(f"Found {processed_count} valid messages")
-    print(f"Encountered {error_count} errors")
-    
-    if messages:
-        try:
-            # Sort by timestamp if available
-            if any('timestamp' in msg and msg['timestamp'] for msg in messages):
-                messages.sort(key=lambda x: x.get('timestamp', ''))
-                print("Messages sorted by timestamp")
-        except Exception as e:
-            print(f"Warning: Could not sort messages by timestamp: {str(e)}")
-        
-        # Save to output file
-        output_path = Path(output_file)
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            for msg in messages:
-                f.write(json.dumps(msg, ensure_ascii=False) + '\n')
-        
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != MANIFEST_VERSION:
+            print(f"Manifest {self.path} is from another version, processing everything")
+            return {}
+        if data.get('options') != self.options:
+            print(f"Processing options changed since {self.path} was written, processing everything")
+            return {}
+        if not self.store_path.exists() or self.store_path.stat().st_size != data.get('store_bytes'):
+            print(f"Record store {self.store_path} doesn't match the manifest, processing everything")
+            return {}
+        return data.get('files', {})
+    
+    def name(self, json_file):
+        return json_file.relative_to(self.export_path).as_posix()
+    
+    def plan(self, message_files):
+        """Queue unchanged files for reuse and return the new or changed ones to parse."""
+        # The manifest is JSON too; skip it if the output sits inside the export
+        message_files = [json_file for json_file in message_files if json_file.resolve() != self.path.resolve()]
+        changed = []
+        for json_file in message_files:
+            name = self.name(json_file)
+            stat = json_file.stat()
+            old = self.previous.get(name)
+            if old and old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+                self.unchanged.append((json_file, old))
+                continue
+            # Size and mtime are only a shortcut; the content hash decides
+            digest = file_sha256(json_file)
+            if old and old['size'] == stat.st_size and old['sha256'] == digest:
+                self.unchanged.append((json_file, dict(old, mtime_ns=stat.st_mtime_ns)))
+                continue
+            self._new_files[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+            changed.append(json_file)
+        current = {self.name(json_file) for json_file in message_files}
+        self.skipped = len(self.unchanged)
+        self.removed = sum(1 for name in self.previous if name not in current)
+        return changed
+    
+    def open_store(self):
+        if self.unchanged:
+            self._old_store = open(self.store_path, 'rb')
+        self.store = open(self.store_path.with_name(self.store_path.name + '.tmp'), 'wb')
+    
+    def begin_file(self, json_file, sorter):
+        """Start json_file's segment, after reusing every unchanged file that precedes it."""
+        self._copy_unchanged(sorter, before=json_file)
+        self._segment_start = self.store.tell()
+    
+    def end_file(self, json_file, count, error):
+        if error:
+            return
+        self.entries[self.name(json_file)] = dict(
+            self._new_files[self.name(json_file)],
+            records=count,
+            offset=self._segment_start,
+            length=self.store.tell() - self._segment_start,
+        )
+    
+    def finish(self, sorter):
+        self._copy_unchanged(sorter, before=None)
+        if self._old_store is not None:
+            self._old_store.close()
+        self.store.close()
+    
+    def commit(self, store_changed=True):
+        """Replace the record store and manifest once the output has been written."""
+        if store_changed:
+            os.replace(self.store_path.with_name(self.store_path.name + '.tmp'), self.store_path)
+        data = {
+            'version': MANIFEST_VERSION,
+            'options': self.options,
+            'store_bytes': self.store_path.stat().st_size,
+            'files': dict(sorted(self.entries.items())),
+        }
+        manifest_tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(manifest_tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+        os.replace(manifest_tmp, self.path)
+    
+    def _copy_unchanged(self, sorter, before):
+        while self.unchanged and (before is None or self.unchanged[0][0] < before):
+            json_file, entry = self.unchanged.popleft()
+            offset = self.store.tell()
+            self._old_store.seek(entry['offset'])
+            remaining = entry['length']
+            while remaining > 0:
+                row = self._old_store.readline()
+                remaining -= len(row)
+                self.store.write(row)
+                key, line = row.decode('utf-8').rstrip('\n').split('\t', 1)
+                sorter.add(int(key), line)
+            self.entries[self.name(json_file)] = dict(entry, offset=offset)
+
+class RecordSink:
+    """Takes each file's keyed records in input order.
+    
+    Records go to the sorter and, in incremental mode, to the manifest's
+    record store as well.
+    """
+    
+    def __init__(self, sorter, manifest=None):
+        self.sorter = sorter
+        self.manifest = manifest
+    
+    def begin_file(self, json_file):
+        if self.manifest is not None:
+            self.manifest.begin_file(json_file, self.sorter)
+    
+    def add(self, key, line):
+        self.sorter.add(key, line)
+        if self.manifest is not None:
+            self.manifest.store.write(f"{key}\t{line}\n".encode('utf-8'))
+    
+    def end_file(self, json_file, count, error):
+        if self.manifest is not None:
+            self.manifest.end_file(json_file, count, error)
+
+def collect_export(message_files, sink, workers):
+    """Load each file whole with json.load and feed its records to the sink."""
+    results, simple_progress = with_progress(iter_file_results(message_files, workers), len(message_files))
+    stats = IngestStats(simple_progress)
+    for json_file, (parsed, records, error) in zip(message_files, results):
+        sink.begin_file(json_file)
+        for key, line in records:
+            sink.add(key, line)
+        sink.end_file(json_file, len(records), error)
+        stats.record(parsed, len(records), error)
+    return stats
+
+def stream_files(message_files, sink):
+    for json_file in message_files:
+        sink.begin_file(json_file)
+        # Records reach the sink only once the whole file has parsed
+        with tempfile.SpooledTemporaryFile(SEGMENT_BUFFER_BYTES, mode='w+', encoding='utf-8',
+                                           dir=sink.sorter.tmp_dir) as segment:
+            parsed, count, error = stream_file(json_file, segment)
+            if not error:
+                segment.seek(0)
+                for key, line in ExternalSorter._read_run(segment):
+                    sink.add(key, line)
+        sink.end_file(json_file, count, error)
+        yield parsed, count, error
+
+def stream_export(message_files, sink, workers):
+    """Feed records to the sink as they are parsed, without holding any file in memory.
+    
+    Each file is streamed to a segment of keyed lines (a spooled temporary
+    file, or a part file with several workers) that is read back in input
+    order once the file has parsed, so a malformed file contributes nothing,
+    as in the default mode, and the result matches a single-process run.
+    """
+    if workers <= 1:
+        results, simple_progress = with_progress(stream_files(message_files, sink), len(message_files))
+        stats = IngestStats(simple_progress)
+        for parsed, count, error in results:
+            stats.record(parsed, count, error)
+        return stats
+    
+    with tempfile.TemporaryDirectory(prefix='parts-', dir=sink.sorter.tmp_dir) as parts_dir:
+        tasks = [(json_file, os.path.join(parts_dir, f"{index}.jsonl"))
+                 for index, json_file in enumerate(message_files)]
+        with multiprocessing.Pool(workers, initializer=set_cleaner, initargs=(cleaner.rules,)) as pool:
+            results, simple_progress = with_progress(
+                pool.imap(stream_file_to_part, tasks, chunksize=pool_chunksize(message_files, workers)),
+                len(message_files),
+            )
+            stats = IngestStats(simple_progress)
+            for (json_file, part_path), (parsed, count, error) in zip(tasks, results):
+                sink.begin_file(json_file)
+                if not error:
+                    with open(part_path, 'r', encoding='utf-8') as part:
+                        for key, line in ExternalSorter._read_run(part):
+                            sink.add(key, line)
+                sink.end_file(json_file, count, error)
+                os.remove(part_path)
+                stats.record(parsed, count, error)
+    return stats
+
+def print_sample(output_path, count=5):
+    print("\nSample of processed messages:")
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line, _ in zip(f, range(count)):
+            msg = json.loads(line)
+            print(f"[{msg.get('timestamp', 'no timestamp')}] {msg['author_name']}: {msg['text'][:100]}{'...' if len(msg['text']) > 100 else ''}")
+
+def process_discord_export(export_path, output_file, workers=1, stream=False, sort_memory_mb=256,
+                           incremental=False, clean_rules=DEFAULT_RULES):
+    set_cleaner(clean_rules)
+    export_path = Path(export_path)
+    # Sorted so every run (and every worker count) sees the files in the same order
+    message_files = sorted(export_path.rglob('*.json'))
+    print(f"Found {len(message_files)} JSON files to process...")
+    if workers > 1:
+        print(f"Using {workers} worker processes")
+    
+    # Save to output file
+    output_path = Path(output_file)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    
+    # Incremental runs parse only new or changed files and reuse the rest's records
+    manifest = None
+    if incremental:
+        manifest = Manifest(f"{output_path}.manifest.json", f"{output_path}.records", export_path,
+                            options=cleaner.config())
+        changed = manifest.plan(message_files)
+        print(f"{len(manifest.unchanged)} unchanged files to reuse, {len(changed)} new or changed, "
+              f"{manifest.removed} removed since the last run")
+        if not changed and not manifest.removed and output_path.exists():
+            # Only mtimes can have moved; the store and output are still current
+            manifest.entries = {manifest.name(json_file): entry for json_file, entry in manifest.unchanged}
+            manifest.commit(store_changed=False)
+            print(f"Nothing changed, {output_file} is up to date")
+            stats = IngestStats(True)
+            stats.skipped = manifest.skipped
+            return stats
+        message_files = changed
+        manifest.open_store()
+    
+    # Records are sorted by parsed timestamp, spilling to disk past the memory budget
+    sorter = ExternalSorter(sort_memory_mb * 1024 * 1024, tmp_dir=output_path.parent)
+    sink = RecordSink(sorter, manifest)
+    if stream:
+        stats = stream_export(message_files, sink, workers)
+    else:
+        stats = collect_export(message_files, sink, workers)
+    if manifest is not None:
+        manifest.finish(sorter)
+        stats.skipped, stats.removed = manifest.skipped, manifest.removed
+    stats.report()
+    
+    # Incremental runs always rewrite the output, even if every file is gone
+    if sorter.count or manifest is not None:
+        spilled = sorter.spilled
+        tmp_path = output_path.with_name(output_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            sorter.write_sorted(f)
+        os.replace(tmp_path, output_path)
+        print(f"Messages sorted by timestamp ({spilled} runs spilled to disk)" if spilled
+              else "Messages sorted by timestamp")
         print(f"Output saved to {output_file}")
         
         # Show sample of processed messages
-        print("\nSample of processed messages:")
-        for msg in messages[:5]:  # Show first 5 messages
-            print(f"[{msg.get('timestamp', 'no timestamp')}] {msg['author_name']}: {msg['text'][:100]}{'...' if len(msg['text']) > 100 else ''}")
+        print_sample(output_path)
+        if manifest is not None:
+            manifest.commit()
+            print(f"{sorter.count} messages in total, manifest saved to {manifest.path}")
     else:
         print("No messages were processed. Check the input files and their structure.")
+    return stats
 
 if __name__ == "__main__":
     import argparse
@@ -129,6 +693,23 @@ if __name__ == "__main__":
     parser.add_argument('export_path', help='Path to the Discord export directory')
     parser.add_argument('--output', '-o', default='discord_messages_processed.jsonl',
                       help='Output file path (default: discord_messages_processed.jsonl)')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                      help='Worker processes parsing files in parallel (default: 1, 0 = all cores)')
+    parser.add_argument('--stream', action='store_true',
+                      help='Parse message arrays incrementally instead of loading each file whole')
+    parser.add_argument('--sort-memory-mb', type=int, default=256,
+                      help=f'Records held in memory while sorting before runs spill to disk (default: 256, minimum: {SORT_MIN_MEMORY_MB})')
+    parser.add_argument('--incremental', action='store_true',
+                      help='Only parse files that are new or changed since the last run (keeps a manifest next to the output)')
+    
+    parser.add_argument('--clean-rules', default='default',
+                      help=f"Comma-separated cleaning rules; 'default' and 'all' expand (default: default = "
+                           f"{','.join(DEFAULT_RULES)}; available: {','.join(RULES)})")
     
     args = parser.parse_args()
-    process_discord_export(args.export_path, args.output)
\ No newline at end of file
+    if args.sort_memory_mb < SORT_MIN_MEMORY_MB:
+        parser.error(f"--sort-memory-mb must be at least {SORT_MIN_MEMORY_MB}")
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    process_discord_export(args.export_path, args.output, workers, stream=args.stream,
+                           sort_memory_mb=args.sort_memory_mb, incremental=args.incremental,
+                           clean_rules=parse_rules(args.clean_rules))
\ No newline at end of file